@@ -1,37 +1,54 @@
 #!/usr/bin/env python
-import sys
-infile = sys.argv[1]
-outfile = sys.argv[1] + 'new'
-outfh = open(outfile, 'w')
+'''
+Clone atomtypes in a force field file.
+
+    addtype.py infile oldtype newtype [oldtype newtype ...]
 
-oldtype, newtype = sys.argv[2:4]
+writes infile + 'new'. Amber .dat files are cloned in memory with
+AmberDat.cloneType, which covers every term involving oldtype at any
+combination of positions. Any other file, e.g. a viparr parameter file, is
+cloned line by line, with the lines mentioning oldtype appended at the end
+with newtype in its place.
+'''
+import sys
 
-newlines = []
-with open(infile, 'r') as infh:
-    for line in infh:
-        line = line.rstrip()
+def clone_lines(lines, oldtype, newtype):
+    newlines = []
+    for line in lines:
         if ' %s"' % oldtype in line:
-            print >> outfh, line
             newline = line.replace(' %s"' % oldtype, ' %s"' % newtype)
             newlines.append(newline)
-            #print >> outfh, newline
         elif '"%s"' % oldtype in line:
-            print >> outfh, line
             newline = line.replace('"%s"' % oldtype, '"%s"' % newtype)
             newlines.append(newline)
-            #print >> outfh, newline
         elif '"%s ' % oldtype in line:
-            print >> outfh, line
             newline = line.replace('"%s ' % oldtype, '"%s ' % newtype)
             newlines.append(newline)
-            #print >> outfh, newline
         elif ' %s ' % oldtype in line:
-            print >> outfh, line
             newline = line.replace(' %s ' % oldtype, ' %s ' % newtype)
             newlines.append(newline)
-            #print >> outfh, newline
-        else:
-            print >> outfh, line
+    return lines + newlines
+
+if __name__ == '__main__':
+    # infile, then one or more oldtype newtype pairs.
+    if len(sys.argv) < 4 or len(sys.argv) % 2 != 0:
+        sys.exit('usage: addtype.py infile oldtype newtype '
+                 '[oldtype newtype ...]')
+    infile = sys.argv[1]
+    outfile = sys.argv[1] + 'new'
+    typepairs = zip(sys.argv[2::2], sys.argv[3::2])
 
-for nl in newlines:
-    print >> outfh, nl
+    if infile.endswith('.dat'):
+        from amberdat import AmberDat
+        dat = AmberDat(infile)
+        for oldtype, newtype in typepairs:
+            dat.cloneType(oldtype, newtype)
+        dat.printDat(outfile)
+    else:
+        with open(infile, 'r') as infh:
+            lines = [line.rstrip() for line in infh]
+        for oldtype, newtype in typepairs:
+            lines = clone_lines(lines, oldtype, newtype)
+        with open(outfile, 'w') as outfh:
+            for line in lines:
+                print >> outfh, line
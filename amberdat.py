@@ -4,60 +4,289 @@
 @created: September 21th, 2017
 '''
 import os, re
+from collections import OrderedDict
+import numpy as np
 import pandas as pd
-from StringIO import StringIO
+import fileio
+import parsecache
+
+# Atomtype columns of every term table, keyed by the table prefix used in the
+# AmberDat attribute names (mass -> mass_df, stretch -> stretch_df, ...).
+_TYPE_COLUMNS = {'mass': ['type'],
+                 'stretch': ['type1', 'type2'],
+                 'angle': ['type1', 'type2', 'type3'],
+                 'proper': ['type1', 'type2', 'type3', 'type4'],
+                 'improper': ['type1', 'type2', 'type3', 'type4'],
+                 'vdw': ['type']}
+
+# Term tables in the order they appear in a .dat file.
+_TABLES = ['mass', 'stretch', 'angle', 'proper', 'improper', 'vdw']
+
+# Full column layout of every term table.
+_TERM_COLUMNS = {'mass': ['type', 'mass', 'pol'],
+                 'stretch': ['type1', 'type2', 'fc', 'r0'],
+                 'angle': ['type1', 'type2', 'type3', 'fc', 'theta0'],
+                 'proper': ['type1', 'type2', 'type3', 'type4', 'divider', 
+                            'fc', 'theta0', 'periodicity'],
+                 'improper': ['type1', 'type2', 'type3', 'type4', 'fc', 
+                              'theta0', 'periodicity'],
+                 'vdw': ['type', 'half_rmin', 'epsilon']}
+
+def _canonical_key(input_types):
+    """
+    Direction-normalized key of an atomtype sequence, i.e. the smaller of the
+    forward and the reversed tuple, so that A-B-C and C-B-A share one key.
+    """
+    intypesf = tuple(input_types)
+    intypesr = intypesf[::-1]
+    return min(intypesf, intypesr)
+
+def _build_term_index(df, labels):
+    """
+    Map the canonical key of every row in df to a list of (row label, types)
+    pairs, in row order. The types are kept in their original direction so 
+    that forward and reverse matches can still be told apart.
+    """
+    term_index = dict()
+    type_columns = [df[l].values for l in labels]
+    for label, types in zip(df.index, zip(*type_columns)):
+        term_index.setdefault(_canonical_key(types), []).append((label, types))
+    return term_index
+
+def _build_type_index(df, labels):
+    """
+    Map every atomtype in df to the labels of the rows it appears in, in row
+    order.
+    """
+    type_index = dict()
+    type_columns = [df[l].values for l in labels]
+    _index_types(type_index, df.index, zip(*type_columns))
+    return type_index
 
-def _check_atomtype_match(df, input_types, labels):
+def _index_types(type_index, row_labels, row_types):
     """
-    Check whether the atomtype combinations in input_types already exists in
-    df. Both the forward and reverse sequence of input_types are checked. 
+    Add rows, given as parallel sequences of labels and atomtype tuples, to
+    an atomtype index. A row is listed once per atomtype, however many times
+    the type occurs in it.
     """
-    intypesf = input_types
-    intypesr = list(reversed(input_types))
-    idx_f = df.index
-    idx_r = df.index
+    for label, types in zip(row_labels, row_types):
+        for t in set(types):
+            type_index.setdefault(t, []).append(label)
 
-    for itf, l in zip(intypesf, labels):
-        idx_match = df.index[df[l] == itf]
-        idx_f = idx_f.intersection(idx_match)
+# Width of the dash-separated atomtype field at the start of each line of the
+# bonded term sections, e.g. 'C -CA' for stretch terms.
+_TYPE_FIELD_WIDTH = {'stretch': 5, 'angle': 8, 'proper': 11, 'improper': 11}
 
-    for itr, l in zip(intypesr, labels):
-        idx_match = df.index[df[l] == itr]
-        idx_r = idx_r.intersection(idx_match)
+# Dtypes of the parameter columns that are not plain floats.
+_PARAM_DTYPES = {'divider': int}
+
+# A newline followed by a line that is empty or holds only whitespace.
+_SECTION_BREAK = re.compile(r'\n[ \t]*(?=\n)')
+
+def _is_stretch_line(line):
+    return len(line) > 2 and line[2] == '-'
+
+def _is_nonbonded_label(section):
+    """
+    Whether a section starts with a 6-12 label line such as 'MOD4      RE'.
+    """
+    return len(section) > 0 and len(section[0].split()) > 1 and \
+           section[0].split()[1] in ['RE', 'SK', 'AC']
+
+def _split_sections(raw_string):
+    """
+    Split the content of a .dat file into its blank-line separated sections
+    in a single pass. Returns the list of sections, each a list of lines, the
+    (start, end) offsets of every section in raw_string and the text from the
+    END line on, without the final newline, or None if there is no END line.
+    """
+    sections = []
+    spans = []
+    start = 0
+    for m in _SECTION_BREAK.finditer(raw_string + '\n\n'):
+        lines = raw_string[start:m.start()].split('\n') \
+                if m.start() > start else []
+        if len(sections) >= 5 and lines and lines[0].strip() == 'END':
+            return sections, spans, raw_string[start:].rstrip('\n')
+        sections.append(lines)
+        spans.append((start, max(start, m.start())))
+        start = m.end() + 1
+    return sections, spans, None
+
+def _parse_terms(table, lines):
+    """
+    Parse the lines of one section into a typed term table. Bonded terms 
+    start with a fixed-width, dash-separated atomtype field, mass and vdw
+    lines with a single atomtype. The parameters follow, separated by spaces,
+    and whatever comes after them is kept in the comment column.
+    """
+    columns = _TERM_COLUMNS[table]
+    ntypes = len(_TYPE_COLUMNS[table])
+    params = columns[ntypes:]
+    if len(lines) == 0:
+        return pd.DataFrame(columns=columns + ['comment'])
+
+    if table in _TYPE_FIELD_WIDTH:
+        width = _TYPE_FIELD_WIDTH[table]
+        types = [line[:width].split('-') for line in lines]
+        fields = [line[width:].split(None, len(params)) for line in lines]
+    else:
+        fields = [line.split(None, len(params) + 1) for line in lines]
+        types = [f[:1] for f in fields]
+        fields = [f[1:] for f in fields]
+    for line, t in zip(lines, types):
+        assert len(t) == ntypes, \
+            "Please check the format of the .dat file: %s" % line
+
+    try:
+        values = np.array([f[:len(params)] for f in fields], dtype=float)
+        assert values.shape == (len(lines), len(params))
+        comments = [f[len(params)] if len(f) > len(params) else '' 
+                    for f in fields]
+    except (ValueError, AssertionError):
+        values, comments = _parse_params_by_line(lines, params, fields)
+
+    data = OrderedDict()
+    for c, column in zip(columns, zip(*types)):
+        data[c] = np.array([t.strip() for t in column], dtype=object)
+    for n, p in enumerate(params):
+        data[p] = values[:, n].astype(_PARAM_DTYPES.get(p, float))
+    data['comment'] = np.array([c.strip() for c in comments], dtype=object)
+    return pd.DataFrame(data)
+
+def _parse_params_by_line(lines, params, fields):
+    """
+    Slow path of _parse_terms for sections with missing fields. Amber reads
+    a blank polarizability as zero, anything else missing is an error.
+    """
+    values = []
+    comments = []
+    for line, f in zip(lines, fields):
+        row = []
+        for p in params:
+            try:
+                row.append(float(f[0]))
+                f = f[1:]
+            except (IndexError, ValueError):
+                assert p == 'pol', \
+                    "Please check the format of the .dat file: %s" % line
+                row.append(0.0)
+        values.append(row)
+        comments.append(' '.join(f))
+    return np.array(values, dtype=float), comments
+
+def _format_terms(df, table, line_format, first_marker=''):
+    """
+    Format the rows of a term table for printDat. The parameter columns are
+    pulled out of the frame once and zipped into rows, instead of going 
+    through iloc row by row. The first line gets first_marker appended.
+    """
+    columns = [df[c].values for c in _TERM_COLUMNS[table]]
+    lines = [line_format % row for row in zip(*columns)]
+    if lines:
+        lines[0] += first_marker
+    return lines
 
-    return idx_f, idx_r
+def _term_frame(terms, columns):
+    """
+    Turn a DataFrame or an iterable of rows into a frame with the given 
+    columns, stripping spaces from the atomtype columns and checking their
+    length for the whole batch at once.
+    """
+    if isinstance(terms, pd.DataFrame):
+        if 'comment' in terms.columns:
+            columns = columns + ['comment']
+        frame = terms[columns].reset_index(drop=True)
+    else:
+        frame = pd.DataFrame([list(t) for t in terms], columns=columns)
+
+    for c in columns:
+        if c.startswith('type'):
+            frame[c] = frame[c].astype(str).str.replace(' ', '')
+            assert frame[c].str.len().between(1, 2).all(), \
+                'Atomtype must be an non-empty string with no more than two characters.'
+    return frame
+
+def _check_periodicity(periodicity):
+    """
+    Vectorized version of the periodicity assertion of the torsion terms.
+    """
+    valid = periodicity.isin([x for x in range(-6, 7) if x != 0])
+    assert valid.all(), \
+            "periodicity of a torsion term has to be a non-zero " \
+            "integer between -6 and 6"
 
 class AmberDat():
     """
     A class describing the .dat file in an AmberFFCombo.
     """
-    def __init__(self, dat_file_path=None):
+    # Attributes set by loadDat, stored in the parse cache.
+    _CACHED_ATTRS = ('title', 'mass_df', 'hydrophilic_line', 'stretch_df', 
+                     'angle_df', 'proper_df', 'improper_df', 
+                     'fast_water_flag', 'equivalent_vdwtype', 'mod', 
+                     'vdw_df', 'extra_sections', 'end', 
+                     '_raw_string', '_block_spans')
+
+    def __init__(self, dat_file_path=None, defer_torsions=False, cache=False,
+                 lazy=False):
+        """
+        With cache set to True, or to a cache directory, the parsed tables
+        are kept on disk by parsecache and reused while the file is 
+        unchanged.
+
+        With lazy, the term tables are only parsed the first time they are
+        accessed. A lazily loaded file is not written to the cache, as that
+        would need all of its tables.
+        """
+        self._term_index = dict()
+        self._type_index = dict()
+        self.defer_torsions = defer_torsions
+        self._pending_torsions = set()
+        self._lazy_tables = dict()
+        self._clean_frames = dict()
         if dat_file_path:
             self.datpath = dat_file_path
-            self.loadDat()
+            if not parsecache.restore(self, self.datpath, cache):
+                self.loadDat(lazy)
+                if not lazy:
+                    parsecache.save(self, self.datpath, cache)
         else:
             self.createDat()
+        self._markClean()
     
     def __repr__(self):
         return "<AmberDat '%s'>" % self.title
 
+    def __getattr__(self, name):
+        """
+        Parse the term tables left out by a lazy loadDat on first access.
+        """
+        lazy_tables = self.__dict__.get('_lazy_tables', {})
+        if name.endswith('_df') and name[:-3] in lazy_tables:
+            return self._loadTable(name[:-3])
+        raise AttributeError(name)
+
+    def _loadTable(self, table):
+        """
+        Parse the lines kept for a lazily loaded term table.
+        """
+        df = _parse_terms(table, self._lazy_tables.pop(table))
+        setattr(self, '%s_df' % table, df)
+        self._clean_frames[table] = df
+        return df
+
 
     def createDat(self):
         """
         Create a .dat file from scratch.
         """
         self.title = 'New AmberDat'
-        self.mass_df = pd.DataFrame(columns=['type', 'mass', 'pol'])
-        self.stretch_df = pd.DataFrame(columns=['type1', 'type2', 'fc', 'r0'])
-        self.angle_df = pd.DataFrame(columns=['type1', 'type2', 'type3', 'fc',
-                                              'theta0'])
-        self.proper_df = pd.DataFrame(columns=['type1', 'type2', 'type3', 
-                                               'type4', 'divider', 'fc', 
-                                               'theta0', 'periodicity'])
-        self.improper_df = pd.DataFrame(columns=['type1', 'type2', 'type3', 
-                                                 'type4', 'fc', 
-                                                 'theta0', 'periodicity'])
-        self.vdw_df = pd.DataFrame(columns=['type', 'half_rmin', 'epsilon'])
+        self.mass_df = _parse_terms('mass', [])
+        self.stretch_df = _parse_terms('stretch', [])
+        self.angle_df = _parse_terms('angle', [])
+        self.proper_df = _parse_terms('proper', [])
+        self.improper_df = _parse_terms('improper', [])
+        self.vdw_df = _parse_terms('vdw', [])
 
         self.hydrophilic_line = \
             'C   H   HO  N   NA  NB  NC  N2  NT  N2  N3  N*  O   OH  OS  P   O2 '        
@@ -66,172 +295,225 @@ class AmberDat():
         self.equivalent_vdwtype = \
             'N   NA  N2  N*  NC  NB  NT  NY\nC*  CA  CB  CC  CD  CK  CM  CN  CQ  CR  CV  CW  CY  CZ  CP  CS'
         self.mod = 'MOD4      RE'
+        self.extra_sections = []
         self.end = 'END'
+        self._raw_string = ''
+        self._block_spans = dict()
 
-    def loadDat(self):
+    def loadDat(self, lazy=False):
         """
-        Load a .dat file into the AmberDat object.
+        Load a .dat file into the AmberDat object. With lazy, the file is 
+        split into its blocks, but the term tables are left to __getattr__.
         """
-        with open(self.datpath, 'r') as fh:
-            raw_string = fh.read()
-        blocklist = raw_string.split('\n\n')
+        raw_string = fileio.read(self.datpath)
+        sections, spans, self.end = _split_sections(raw_string)
 
-        assert len(blocklist) == 9, \
+        assert len(sections) >= 5 and self.end is not None, \
                 "Please check the format of the .dat file."
 
         # Load title and mass
-        self.title = blocklist[0].split('\n')[0] # First line
-        mass_block_csv = StringIO(blocklist[0])
-        self.mass_df = pd.read_csv(mass_block_csv, sep='\s+', 
-                                   skip_blank_lines=True,
-                                   keep_default_na=False,
-                                   header=None, names=['type', 'mass', 'pol'],
-                                   usecols=[0, 1, 2], skiprows=[0])
-        self.mass_df.replace(r'\s*([^\s]+)\s*', r'\1', inplace=True, regex=True)
-
-        # Load stretch terms
-        self.hydrophilic_line = blocklist[1].split('\n')[0]
-        stretch_block_csv = StringIO(blocklist[1])
-        self.stretch_df = pd.read_csv(stretch_block_csv, sep='\s\s+|-', 
-                                      engine='python', header=None,
-                                      skip_blank_lines=True,
-                                      keep_default_na=False,
-                                      names=['type1', 'type2', 'fc', 'r0'],
-                                      usecols=[0, 1, 2, 3], skiprows=[0])
-        self.stretch_df.replace(r'\s*([^\s]+)\s*', r'\1', inplace=True, regex=True)
-
-        # Load angle terms
-        angle_block_csv = StringIO(blocklist[2])
-        self.angle_df = pd.read_csv(angle_block_csv, sep='\s\s+|-', 
-                                    engine='python', header=None,
-                                    skip_blank_lines=True,
-                                    keep_default_na=False,
-                                    names=['type1', 'type2', 'type3', 'fc', 'theta0'],
-                                    usecols=[0, 1, 2, 3, 4])
-        self.angle_df.replace(r'\s*([^\s]+)\s*', r'\1', inplace=True, regex=True)
-
-        # Load proper torsion terms
-        proper_block_csv = StringIO(blocklist[3])
-        data_df = pd.read_csv(proper_block_csv, sep='\s\s+', 
-                              engine='python', header=None,
-                              skip_blank_lines=True,
-                              keep_default_na=False,
-                              names=['divider', 'fc', 
-                                     'theta0','periodicity'],
-                              usecols=[1, 2, 3, 4])
-
-        proper_block_csv = StringIO(blocklist[3])
-        type_df = pd.read_csv(proper_block_csv, sep='\s\s+|-', header=None,
-                              engine='python',
-                              skip_blank_lines=True, keep_default_na=False,
-                              names=['type1', 'type2', 'type3', 'type4'],
-                              usecols=[0, 1, 2, 3])
-        self.proper_df = pd.concat([type_df, data_df], axis=1)
-        self.proper_df.replace(r'\s*([^\s]+)\s*', r'\1', inplace=True, regex=True)
-
-        # Load improper torsion terms
-        improper_block_csv = StringIO(blocklist[4])
-        data_df = pd.read_csv(improper_block_csv, sep='\s\s+', 
-                              engine='python', header=None,
-                              skip_blank_lines=True,
-                              keep_default_na=False,
-                              names=['fc', 'theta0', 'periodicity'],
-                              usecols=[1, 2, 3])
-
-        improper_block_csv = StringIO(blocklist[4])
-        type_df = pd.read_csv(improper_block_csv, sep='\s\s+|-', 
-                              engine='python', header=None,
-                              skip_blank_lines=True,
-                              keep_default_na=False,
-                              names=['type1', 'type2', 'type3', 'type4'],
-                              usecols=[0, 1, 2, 3])
-
-        self.improper_df = pd.concat([type_df, data_df], axis=1)
-        self.improper_df.replace(r'\s*([^\s]+)\s*', r'\1', inplace=True, regex=True)
-
-        # Load other stuff
-        self.fast_water_flag = blocklist[5]
-        self.equivalent_vdwtype = blocklist[6]
+        self.title = sections[0][0]
+        self._lazy_tables = {'mass': sections[0][1:]}
+
+        # Load hydrophilic atomtypes, which may span several lines, and 
+        # stretch terms
+        n = 0
+        while n < len(sections[1]) and not _is_stretch_line(sections[1][n]):
+            n += 1
+        self.hydrophilic_line = '\n'.join(sections[1][:n])
+        self._lazy_tables['stretch'] = sections[1][n:]
+
+        # Load angle and torsion terms
+        self._lazy_tables['angle'] = sections[2]
+        self._lazy_tables['proper'] = sections[3]
+        self._lazy_tables['improper'] = sections[4]
+
+        # Load other stuff. The hbond and equivalencing sections come before
+        # the first 6-12 section, any further sections (more MOD4 blocks,
+        # LJEDIT) are kept verbatim.
+        nonbonded = [n for n, sec in enumerate(sections) 
+                     if n >= 5 and _is_nonbonded_label(sec)]
+        assert len(nonbonded) > 0 and nonbonded[0] <= 7, \
+                "Please check the format of the .dat file."
+        other = ['\n'.join(sec) for sec in sections[5:nonbonded[0]]]
+        other += [''] * (2 - len(other))
+        self.fast_water_flag, self.equivalent_vdwtype = other
 
         # Load vdw terms
-        self.mod = blocklist[7].split('\n')[0]
-        vdw_block_csv = StringIO(blocklist[7])
-        self.vdw_df = pd.read_csv(vdw_block_csv, sep='\s+', 
-                                  engine='python', header=None,
-                                  skip_blank_lines=True,
-                                  keep_default_na=False,
-                                  names=['type', 'half_rmin', 'epsilon'],
-                                  usecols=[0, 1, 2], skiprows=[0])
-        #self.vdw_df['sigma'] = self.vdw_df.half_rmin/(2**(1./6))*2.
-        self.vdw_df.replace(r'\s*([^\s]+)\s*', r'\1', inplace=True, regex=True)
-
-        # Load last line
-        self.end = blocklist[8]
-
-    def printDat(self, out_file_path):
+        vdw_section = sections[nonbonded[0]]
+        self.mod = vdw_section[0]
+        self._lazy_tables['vdw'] = vdw_section[1:]
+        self.extra_sections = ['\n'.join(sec) 
+                               for sec in sections[nonbonded[0] + 1:]]
+
+        # Keep the original text of the term blocks, so that printDat can 
+        # copy the ones that were not modified instead of reformatting them.
+        # Each block is stored as (start, end of header, end) offsets, the 
+        # header being the title, hydrophilic or MOD4 lines in front of the 
+        # terms.
+        self._raw_string = raw_string
+        self._block_spans = dict()
+        for table, n_sec, header in [('mass', 0, self.title), 
+                                     ('stretch', 1, self.hydrophilic_line),
+                                     ('angle', 2, ''), ('proper', 3, ''),
+                                     ('improper', 4, ''),
+                                     ('vdw', nonbonded[0], self.mod)]:
+            start, end = spans[n_sec]
+            self._block_spans[table] = (start, start + len(header), end)
+
+        if not lazy:
+            for table in self._lazy_tables.keys():
+                self._loadTable(table)
+
+    def _markClean(self):
         """
-        Print out an AmberDat object following strict format.
+        Forget about all modifications, i.e. treat the term tables as they 
+        are now as the ones read from the file.
         """
-        out_fh = open(out_file_path, 'w')
-        print >> out_fh, self.title
-
-        # print mass block
-        for n in range(len(self.mass_df)):
-            row = self.mass_df.iloc[n]
-            if n == 0:
-                print >> out_fh, "%-2s%6s%14.3f  !" % tuple(row)
-            else:
-                print >> out_fh, "%-2s%6s%14.3f" % tuple(row)
-
-        print >> out_fh, ''
-        print >> out_fh, self.hydrophilic_line
-
-        # print stretch block
-        for n in range(len(self.stretch_df)):
-            row = self.stretch_df.iloc[n]
-            if n == 0:
-                print >> out_fh, "%-2s-%-2s%7.1f%9.3f     !" % tuple(row)
-            else:
-                print >> out_fh, "%-2s-%-2s%7.1f%9.3f" % tuple(row)
-
-        print >> out_fh, ''
-
-        # print angle block
-        for n in range(len(self.angle_df)):
-            row = self.angle_df.iloc[n]
-            print >> out_fh, "%-2s-%-2s-%-2s%8.1f%12.2f" % tuple(row)
-
-        print >> out_fh, ''
-
-        # print proper block
-        for n in range(len(self.proper_df)):
-            row = self.proper_df.iloc[n]
-            print >> out_fh, "%-2s-%-2s-%-2s-%-2s%4d%8.3f%13.1f%14.0f." % tuple(row)
-
-        print >> out_fh, ''
+        self._dirty = set()
+        self._clean_frames = dict((t, self.__dict__['%s_df' % t]) 
+                                  for t in _TYPE_COLUMNS 
+                                  if '%s_df' % t in self.__dict__)
 
-        # print improper block
-        for n in range(len(self.improper_df)):
-            row = self.improper_df.iloc[n]
-            print >> out_fh, "%-2s-%-2s-%-2s-%-2s         %-13.1f%-14s%.0f." % tuple(row)
+    def markModified(self, table):
+        """
+        Flag a term table ('mass', 'stretch', 'angle', 'proper', 'improper' 
+        or 'vdw') as modified. The add and set methods do this themselves, 
+        it is only needed after editing one of the *_df frames in place.
+        The indexes of the table are dropped, as the edit may have changed
+        its atomtypes.
+        """
+        assert table in _TYPE_COLUMNS, "Unknown term table %s." % table
+        self._dirty.add(table)
+        self._term_index.pop(table, None)
+        self._type_index.pop(table, None)
 
-        print >> out_fh, ''
-        print >> out_fh, self.fast_water_flag
-        print >> out_fh, ''
-        print >> out_fh, self.equivalent_vdwtype
-        print >> out_fh, ''
-        print >> out_fh, self.mod
+    def _verbatimBlock(self, table, header):
+        """
+        Return the original text of the block holding a term table, or None
+        if the block has to be reformatted because the table or its header 
+        was modified, or it was not read from a file.
+        """
+        if table not in self._block_spans or table in self._dirty:
+            return None
+        # Tables a lazy load has not parsed yet are untouched.
+        if '%s_df' % table in self.__dict__:
+            df = self.__dict__['%s_df' % table]
+            clean_df = self._clean_frames.get(table)
+            if df is not clean_df or len(df) != len(clean_df):
+                return None
+        start, header_end, end = self._block_spans[table]
+        if self._raw_string[start:header_end] != header:
+            return None
+        return self._raw_string[start:end]
 
-        # print vdw block
-        for n in range(len(self.vdw_df)):
-            row = self.vdw_df.iloc[n]
-            if n == 0:
-                print >> out_fh, "%4s%16.4f%8.4f            !" % tuple(row)
+    def printDat(self, out_file_path):
+        """
+        Print out an AmberDat object following strict format, compressed if
+        out_file_path ends with .gz, .bz2 or .xz.
+        """
+        self.finalizeTorsions()
+        lines = []
+        for table, header, line_format, first_marker in [
+                ('mass', self.title, "%-2s%6s%14.3f", "  !"),
+                ('stretch', self.hydrophilic_line, "%-2s-%-2s%7.1f%9.3f", 
+                 "     !"),
+                ('angle', None, "%-2s-%-2s-%-2s%8.1f%12.2f", ''),
+                ('proper', None, "%-2s-%-2s-%-2s-%-2s%4d%8.3f%13.1f%14.0f.",
+                 ''),
+                ('improper', None, 
+                 "%-2s-%-2s-%-2s-%-2s         %-13.1f%-14s%.0f.", ''),
+                ('vdw', self.mod, "%4s%16.4f%8.4f", "            !")]:
+            if table == 'vdw':
+                lines += [self.fast_water_flag, '', self.equivalent_vdwtype, 
+                          '']
+            block = self._verbatimBlock(table, header or '')
+            if block is not None:
+                lines += [block]
             else:
-                print >> out_fh, "%4s%16.4f%8.4f" % tuple(row)
-
-        print >> out_fh, ''
-        print >> out_fh, self.end
+                if header is not None:
+                    lines += [header]
+                lines += _format_terms(getattr(self, '%s_df' % table), table, 
+                                       line_format, first_marker)
+            lines += ['']
+        for section in self.extra_sections:
+            lines += [section, '']
+        lines += [self.end]
+
+        with fileio.open_output(out_file_path) as out_fh:
+            out_fh.write('\n'.join(lines) + '\n')
+
+    def _termIndex(self, table):
+        """
+        Return the canonical-key index of a term table, (re)building it when
+        the table has been replaced or resized outside of the add methods.
+        """
+        df = getattr(self, '%s_df' % table)
+        signature = (id(df), len(df))
+        if table not in self._term_index or \
+                self._term_index[table][0] != signature:
+            self._term_index[table] = \
+                (signature, _build_term_index(df, _TYPE_COLUMNS[table]))
+        return self._term_index[table][1]
+
+    def _typeIndex(self, table):
+        """
+        Return the atomtype index of a term table, (re)building it under the
+        same conditions as the canonical-key index.
+        """
+        df = getattr(self, '%s_df' % table)
+        signature = (id(df), len(df))
+        if table not in self._type_index or \
+                self._type_index[table][0] != signature:
+            self._type_index[table] = \
+                (signature, _build_type_index(df, _TYPE_COLUMNS[table]))
+        return self._type_index[table][1]
+
+    def termsInvolving(self, atomtype, tables=None):
+        """
+        Return an OrderedDict mapping each of tables, all term tables by 
+        default, to the sub-frame of the rows that involve atomtype. The rows
+        come from the atomtype index, so the type columns are not scanned.
+        """
+        atomtype = atomtype.replace(' ', '')
+        if tables is None:
+            tables = _TABLES
+        terms = OrderedDict()
+        for table in tables:
+            assert table in _TYPE_COLUMNS, "Unknown term table %s." % table
+            labels = self._typeIndex(table).get(atomtype, [])
+            terms[table] = getattr(self, '%s_df' % table).loc[labels]
+        return terms
+
+    def _matchTerm(self, table, input_types):
+        """
+        Index-backed lookup of input_types in a term table. Returns the labels
+        of the rows matching the forward and the reverse sequence, the same 
+        way the old column-scan matching did.
+        """
+        intypesf = tuple(input_types)
+        intypesr = intypesf[::-1]
+        rows = self._termIndex(table).get(_canonical_key(intypesf), [])
+        idx_f = pd.Index([label for label, types in rows if types == intypesf])
+        idx_r = pd.Index([label for label, types in rows if types == intypesr])
+        return idx_f, idx_r
+
+    def _appendTerm(self, table, row):
+        """
+        Append a row to a term table and register it in the term and 
+        atomtype indexes.
+        """
+        term_index = self._termIndex(table)
+        type_index = self._typeIndex(table)
+        df = getattr(self, '%s_df' % table)
+        n = len(df)
+        df.loc[n] = list(row) + [''] * (len(df.columns) - len(row))
+        self._dirty.add(table)
+        types = tuple(row[:len(_TYPE_COLUMNS[table])])
+        term_index.setdefault(_canonical_key(types), []).append((n, types))
+        _index_types(type_index, [n], [types])
+        self._term_index[table] = ((id(df), len(df)), term_index)
+        self._type_index[table] = ((id(df), len(df)), type_index)
 
     def setTitle(self, new_title):
         self.title = new_title
@@ -243,13 +525,12 @@ class AmberDat():
         assert 0 < len(atomtype) < 3, \
             'Atomtype must be an non-empty string with no more than two characters.'
 
-        idx, _ = _check_atomtype_match(self.mass_df, [atomtype], ['type'])
+        idx, _ = self._matchTerm('mass', [atomtype])
         if len(idx) == 1:
             print "Atomtype %s already exists in %s, no mass added." \
                     % (atomtype, self)
         elif len(idx) == 0:
-            n = len(self.mass_df)
-            self.mass_df.loc[n] = [atomtype, new_mass, 0.000]
+            self._appendTerm('mass', [atomtype, new_mass, 0.000])
             print "Atomtype %s with mass %.3f added to %s." \
                     % (atomtype, new_mass, self)
         else:
@@ -259,9 +540,10 @@ class AmberDat():
         assert new_mass >= 0, \
             'Mass of an atom cannot be negative.'
 
-        idx, _ = _check_atomtype_match(self.mass_df, [atomtype], ['type'])
+        idx, _ = self._matchTerm('mass', [atomtype])
         if len(idx) == 1:
             self.mass_df.loc[idx, 'mass'] = new_mass
+            self._dirty.add('mass')
             print "Mass of atomtype %s has been set to %.3f." \
                     % (atomtype, new_mass)
         elif len(idx) == 0:
@@ -279,8 +561,7 @@ class AmberDat():
         assert 0 < len(atomtype1) < 3 and 0 < len(atomtype2) < 3, \
             'Atomtype must be an non-empty string with no more than two characters.'
 
-        idf, idr = _check_atomtype_match(self.stretch_df, 
-                       [atomtype1, atomtype2], ['type1', 'type2'])
+        idf, idr = self._matchTerm('stretch', [atomtype1, atomtype2])
 
         if len(idf) == 1 and len(idr) == 0:
             print "Stretch term %-2s-%-2s already exists in %s, no term added." \
@@ -291,8 +572,7 @@ class AmberDat():
                     % (atomtype2, atomtype1, self)
 
         elif len(idf) == 0 and len(idr) == 0:
-            n = len(self.stretch_df)
-            self.stretch_df.loc[n] = [atomtype1, atomtype2, new_fc, new_r0]
+            self._appendTerm('stretch', [atomtype1, atomtype2, new_fc, new_r0])
             print "Stretch term %-2s-%-2s with fc %.1f and r0 %.3f added to %s," \
                   % (atomtype1, atomtype2, new_fc, new_r0, self)
 
@@ -304,11 +584,11 @@ class AmberDat():
         assert new_fc >= 0, \
             "Force constant (fc) of a stretch term cannot be negative."
 
-        idf, idr = _check_atomtype_match(self.stretch_df, 
-                       [atomtype1, atomtype2], ['type1', 'type2'])
+        idf, idr = self._matchTerm('stretch', [atomtype1, atomtype2])
         if len(idf) == 1 and len(idr) == 0:
             self.stretch_df.loc[idf, 'fc'] = new_fc
             self.stretch_df.loc[idf, 'r0'] = new_r0
+            self._dirty.add('stretch')
             print "fc of stretch term %-2s-%-2s has been set to %.1f." \
                     % (atomtype1, atomtype2, new_fc)
             print "r0 of stretch term %-2s-%-2s has been set to %.3f." \
@@ -317,6 +597,7 @@ class AmberDat():
         elif len(idf) == 0 and len(idr) == 1:
             self.stretch_df.loc[idr, 'fc'] = new_fc
             self.stretch_df.loc[idr, 'r0'] = new_r0
+            self._dirty.add('stretch')
             print "fc of stretch term %-2s-%-2s has been set to %.1f." \
                     % (atomtype2, atomtype1, new_fc)
             print "r0 of stretch term %-2s-%-2s has been set to %.3f." \
@@ -341,9 +622,8 @@ class AmberDat():
             0 < len(atomtype3) < 3, \
             'Atomtype must be an non-empty string with no more than two characters.'
 
-        idf, idr = _check_atomtype_match(self.angle_df, 
-                       [atomtype1, atomtype2, atomtype3], 
-                       ['type1', 'type2', 'type3'])
+        idf, idr = self._matchTerm('angle', 
+                       [atomtype1, atomtype2, atomtype3])
 
         if len(idf) == 1 and len(idr) == 0:
             print "Angle term %-2s-%-2s-%-2s already exists in %s, no term added." \
@@ -354,8 +634,8 @@ class AmberDat():
                     % (atomtype3, atomtype2, atomtype1, self)
 
         elif len(idf) == 0 and len(idr) == 0:
-            n = len(self.angle_df)
-            self.angle_df.loc[n] = [atomtype1, atomtype2, atomtype3, new_fc, new_theta0]
+            self._appendTerm('angle', [atomtype1, atomtype2, atomtype3, 
+                                     new_fc, new_theta0])
             print "Angle term %-2s-%-2s-%-2s with fc %.1f and theta0 %.3f added to %s," \
                   % (atomtype1, atomtype2, atomtype3, new_fc, new_theta0, self)
 
@@ -367,13 +647,13 @@ class AmberDat():
         assert new_fc >= 0, \
             "Force constant (fc) of an angle term cannot be negative."
 
-        idf, idr = _check_atomtype_match(self.angle_df, 
-                       [atomtype1, atomtype2, atomtype3], 
-                       ['type1', 'type2', 'type3'])
+        idf, idr = self._matchTerm('angle', 
+                       [atomtype1, atomtype2, atomtype3])
 
         if len(idf) == 1 and len(idr) == 0:
             self.angle_df.loc[idf, 'fc'] = new_fc
             self.angle_df.loc[idf, 'theta0'] = new_theta0
+            self._dirty.add('angle')
             print "fc of angle term %-2s-%-2s-%-2s has been set to %.1f." \
                     % (atomtype1, atomtype2, atomtype3, new_fc)
             print "theta0 of angle term %-2s-%-2s-%-2s has been set to %.2f." \
@@ -382,6 +662,7 @@ class AmberDat():
         elif len(idf) == 0 and len(idr) == 1:
             self.angle_df.loc[idr, 'fc'] = new_fc
             self.angle_df.loc[idr, 'theta0'] = new_theta0
+            self._dirty.add('angle')
             print "fc of angle term %-2s-%-2s-%-2s has been set to %.1f." \
                     % (atomtype3, atomtype2, atomtype1, new_fc)
             print "theta0 of angle term %-2s-%-2s-%-2s has been set to %.2f." \
@@ -411,12 +692,15 @@ class AmberDat():
             0 < len(atomtype3) < 3 and 0 < len(atomtype4) < 3, \
             'Atomtype must be an non-empty string with no more than two characters.'
 
-        n = len(self.proper_df)
-        self.proper_df.loc[n] = [atomtype1, atomtype2, atomtype3, atomtype4,
-                                 new_divider, new_fc, new_theta0, 
-                                 new_periodicity]
+        self._appendTerm('proper', [atomtype1, atomtype2, atomtype3, atomtype4,
+                                     new_divider, new_fc, new_theta0, 
+                                     new_periodicity])
         
-        self._refreshProper(atomtype1, atomtype2, atomtype3, atomtype4)
+        if self.defer_torsions:
+            self._pending_torsions.add(
+                '-'.join([atomtype1, atomtype2, atomtype3, atomtype4]))
+        else:
+            self._refreshProper(atomtype1, atomtype2, atomtype3, atomtype4)
         print "Proper term %-2s-%-2s-%-2s-%-2s with divider %d fc %.3f" \
               % (atomtype1, atomtype2, atomtype3, atomtype4, 
                  new_divider, new_fc),
@@ -424,9 +708,8 @@ class AmberDat():
               % (new_theta0, new_periodicity)
 
     def _refreshProper(self, atomtype1, atomtype2, atomtype3, atomtype4):
-        idf, idr = _check_atomtype_match(self.proper_df, 
-                       [atomtype1, atomtype2, atomtype3, atomtype4], 
-                       ['type1', 'type2', 'type3', 'type4'])
+        idf, idr = self._matchTerm('proper', 
+                       [atomtype1, atomtype2, atomtype3, atomtype4])
 
         if len(idf) > 0 and len(idr) == 0:
             for i in idf[:-1]:
@@ -471,18 +754,17 @@ class AmberDat():
             0 < len(atomtype3) < 3 and 0 < len(atomtype4) < 3, \
             'Atomtype must be an non-empty string with no more than two characters.'
 
-        idf, _ = _check_atomtype_match(self.improper_df, 
-                       [atomtype1, atomtype2, atomtype3, atomtype4], 
-                       ['type1', 'type2', 'type3', 'type4'])
+        idf, _ = self._matchTerm('improper', 
+                       [atomtype1, atomtype2, atomtype3, atomtype4])
 
         if len(idf) == 1:
             print "Improper term %-2s-%-2s-%-2s-%-2s already exists in %s, no term added." \
                     % (atomtype1, atomtype2, atomtype3, atomtype4, self)
 
         elif len(idf) == 0:
-            n = len(self.improper_df)
-            self.improper_df.loc[n] = [atomtype1, atomtype2, atomtype3, atomtype4, 
-                                       new_fc, new_theta0, new_periodicity]
+            self._appendTerm('improper', [atomtype1, atomtype2, atomtype3, 
+                                            atomtype4, new_fc, new_theta0, 
+                                            new_periodicity])
             print "Improper term %-2s-%-2s-%-2s-%-2s with fc %.1f theta0 %.1f periodicity %d added to %s," \
                   % (atomtype1, atomtype2, atomtype3, atomtype4, new_fc, 
                      new_theta0, new_periodicity, self)
@@ -507,14 +789,14 @@ class AmberDat():
             0 < len(atomtype3) < 3 and 0 < len(atomtype4) < 3, \
             'Atomtype must be an non-empty string with no more than two characters.'
 
-        idf, _ = _check_atomtype_match(self.improper_df, 
-                       [atomtype1, atomtype2, atomtype3, atomtype4], 
-                       ['type1', 'type2', 'type3', 'type4'])
+        idf, _ = self._matchTerm('improper', 
+                       [atomtype1, atomtype2, atomtype3, atomtype4])
 
         if len(idf) == 1:
             self.improper_df.loc[idf, 'fc'] = new_fc
             self.improper_df.loc[idf, 'theta0'] = new_theta0
             self.improper_df.loc[idf, 'periodicity'] = new_periodicity
+            self._dirty.add('improper')
             print "fc of improper term %-2s-%-2s-%-2s-%-2s set to %.1f" \
                     % (atomtype1, atomtype2, atomtype3, atomtype4, new_fc)
             print "theta0 of improper term %-2s-%-2s-%-2s-%-2s set to %.1f" \
@@ -539,20 +821,21 @@ class AmberDat():
         assert 0 < len(atomtype) < 3, \
             'Atomtype must be an non-empty string with no more than two characters.'
 
-        if atomtype in self.vdw_df.type.values:
+        idx, _ = self._matchTerm('vdw', [atomtype])
+        if len(idx) > 0:
             print "Atomtype %s already exists in %s, no vdw params added." \
                     % (atomtype, self)
         else:
-            n = len(self.vdw_df)
-            self.vdw_df.loc[n] = [atomtype, new_half_rmin, new_epsilon]
+            self._appendTerm('vdw', [atomtype, new_half_rmin, new_epsilon])
             print "Atomtype %s with half_rmin %.4f epsilon %.4f added to %s." \
                     % (atomtype, new_half_rmin, new_epsilon, self)
 
     def setVdw(self, atomtype, new_half_rmin, new_epsilon):
-        if atomtype in self.vdw_df.type.values:
-            index = self.vdw_df.index[self.vdw_df.type == atomtype]
-            self.vdw_df.loc[index, 'half_rmin'] = new_half_rmin
-            self.vdw_df.loc[index, 'epsilon'] = new_epsilon
+        idx, _ = self._matchTerm('vdw', [atomtype])
+        if len(idx) > 0:
+            self.vdw_df.loc[idx, 'half_rmin'] = new_half_rmin
+            self.vdw_df.loc[idx, 'epsilon'] = new_epsilon
+            self._dirty.add('vdw')
             print "Half Rmin of atomtype %s has been set to %.4f" \
                     % (atomtype, new_half_rmin)
             print "Epsilon of atomtype %s has been set to %.4f" \
@@ -560,3 +843,337 @@ class AmberDat():
         else:
             print "Atomtype %s does not exist in %s, no vdw params set" \
                     % (atomtype, self)
+
+    def _matchTerms(self, table, frame, directional=False):
+        """
+        Join the atomtypes of a batch of terms against the term index. Returns
+        a Series with, for every row in frame, the label of the unique row in
+        the table it matches (forward only if directional, otherwise forward
+        or reverse), -1 if there is no match and -2 if the match is ambiguous.
+        """
+        term_index = self._termIndex(table)
+        type_columns = [frame[c].values for c in _TYPE_COLUMNS[table]]
+        labels = []
+        for intypesf in zip(*type_columns):
+            intypesr = intypesf[::-1]
+            rows = term_index.get(_canonical_key(intypesf), [])
+            idx_f = [label for label, types in rows if types == intypesf]
+            idx_r = [label for label, types in rows if types == intypesr]
+            if directional or table in ['mass', 'vdw']:
+                idx_r = []
+            if len(idx_f) + len(idx_r) == 0:
+                labels.append(-1)
+            elif len(idx_f) == 1 and len(idx_r) == 0:
+                labels.append(idx_f[0])
+            elif len(idx_f) == 0 and len(idx_r) == 1:
+                labels.append(idx_r[0])
+            else:
+                labels.append(-2)
+        return pd.Series(labels, index=frame.index)
+
+    def _addTerms(self, table, frame, directional=False, unique=True):
+        """
+        Append a batch of terms to a table in a single concat. With unique,
+        terms that already exist in the table, or earlier in the batch, are
+        skipped and returned.
+        """
+        if unique:
+            type_columns = [frame[c].values for c in _TYPE_COLUMNS[table]]
+            if directional:
+                keys = pd.Series(zip(*type_columns), index=frame.index)
+            else:
+                keys = pd.Series([_canonical_key(t) for t in zip(*type_columns)],
+                                 index=frame.index)
+            exists = self._matchTerms(table, frame, directional) != -1
+            skip = exists | keys.duplicated()
+        else:
+            skip = pd.Series(False, index=frame.index)
+
+        new_df = frame[~skip].reindex(
+                    columns=_TERM_COLUMNS[table] + ['comment'], fill_value='')
+        if len(new_df) > 0:
+            term_index = self._termIndex(table)
+            type_index = self._typeIndex(table)
+            df = getattr(self, '%s_df' % table)
+            n = len(df)
+            new_df.index = range(n, n + len(new_df))
+            df = pd.concat([df, new_df])
+            setattr(self, '%s_df' % table, df)
+            self._dirty.add(table)
+
+            type_columns = [new_df[c].values for c in _TYPE_COLUMNS[table]]
+            for label, types in zip(new_df.index, zip(*type_columns)):
+                term_index.setdefault(_canonical_key(types), []).append(
+                    (label, types))
+            _index_types(type_index, new_df.index, zip(*type_columns))
+            self._term_index[table] = ((id(df), len(df)), term_index)
+            self._type_index[table] = ((id(df), len(df)), type_index)
+
+        print "%d %s terms added to %s, %d skipped." \
+                % (len(new_df), table, self, skip.sum())
+        return frame[skip]
+
+    def _setTerms(self, table, frame, param_columns, directional=False,
+                  all_matches=False):
+        """
+        Overwrite param_columns of the existing terms matching a batch in one
+        assignment. Like the single-term set methods, a term is only set if 
+        it matches exactly one row, unless all_matches is given, in which 
+        case every row with the same forward types is set, as setVdw does.
+        Terms that are not set are skipped and returned.
+        """
+        if all_matches:
+            term_index = self._termIndex(table)
+            type_columns = [frame[c].values for c in _TYPE_COLUMNS[table]]
+            sources, labels = [], []
+            for n, intypesf in enumerate(zip(*type_columns)):
+                for label, types in \
+                        term_index.get(_canonical_key(intypesf), []):
+                    if types == intypesf:
+                        sources.append(n)
+                        labels.append(label)
+            found = pd.Series(False, index=frame.index)
+            found.iloc[sources] = True
+        else:
+            matches = self._matchTerms(table, frame, directional)
+            found = matches >= 0
+            sources = np.flatnonzero(found.values)
+            labels = matches[found].values
+        if len(labels) > 0:
+            df = getattr(self, '%s_df' % table)
+            df.loc[labels, param_columns] = \
+                frame[param_columns].values[sources]
+            self._dirty.add(table)
+
+        print "%d %s terms set in %s, %d skipped." \
+                % (found.sum(), table, self, (~found).sum())
+        return frame[~found]
+
+    def addMasses(self, terms):
+        """
+        Bulk version of addMass. terms is a DataFrame or an iterable of rows
+        with columns type, mass and, optionally, pol, which is 0.0 where it
+        is missing.
+        """
+        if isinstance(terms, pd.DataFrame):
+            with_pol = 'pol' in terms.columns
+        else:
+            terms = [list(t) for t in terms]
+            with_pol = any(len(t) > 2 for t in terms)
+            if with_pol:
+                terms = [t + [0.000] * (3 - len(t)) for t in terms]
+        if with_pol:
+            frame = _term_frame(terms, ['type', 'mass', 'pol'])
+        else:
+            frame = _term_frame(terms, ['type', 'mass'])
+            frame['pol'] = 0.000
+        assert (frame['mass'] >= 0).all(), \
+            'Mass of an atom cannot be negative.'
+        return self._addTerms('mass', frame)
+
+    def setMasses(self, terms):
+        """
+        Bulk version of setMass. terms has columns type and mass.
+        """
+        frame = _term_frame(terms, ['type', 'mass'])
+        assert (frame['mass'] >= 0).all(), \
+            'Mass of an atom cannot be negative.'
+        return self._setTerms('mass', frame, ['mass'])
+
+    def addStretches(self, terms):
+        """
+        Bulk version of addStretch. terms has columns type1, type2, fc, r0.
+        """
+        frame = _term_frame(terms, _TERM_COLUMNS['stretch'])
+        assert (frame['fc'] >= 0).all(), \
+            "Force constant (fc) of a stretch term cannot be negative."
+        return self._addTerms('stretch', frame)
+
+    def setStretches(self, terms):
+        """
+        Bulk version of setStretch. terms has columns type1, type2, fc, r0.
+        """
+        frame = _term_frame(terms, _TERM_COLUMNS['stretch'])
+        assert (frame['fc'] >= 0).all(), \
+            "Force constant (fc) of a stretch term cannot be negative."
+        return self._setTerms('stretch', frame, ['fc', 'r0'])
+
+    def addAngles(self, terms):
+        """
+        Bulk version of addAngle. terms has columns type1, type2, type3, fc
+        and theta0.
+        """
+        frame = _term_frame(terms, _TERM_COLUMNS['angle'])
+        assert (frame['fc'] >= 0).all(), \
+            "Force constant (fc) of a angle term cannot be negative."
+        return self._addTerms('angle', frame)
+
+    def setAngles(self, terms):
+        """
+        Bulk version of setAngle. terms has columns type1, type2, type3, fc
+        and theta0.
+        """
+        frame = _term_frame(terms, _TERM_COLUMNS['angle'])
+        assert (frame['fc'] >= 0).all(), \
+            "Force constant (fc) of an angle term cannot be negative."
+        return self._setTerms('angle', frame, ['fc', 'theta0'])
+
+    def addPropers(self, terms):
+        """
+        Bulk version of addProper. terms has columns type1, type2, type3, 
+        type4, divider, fc, theta0 and periodicity. Rows sharing the same 
+        types are Fourier components of one torsion, so nothing is skipped;
+        the periodicity signs of every touched torsion are refreshed at once,
+        or at finalizeTorsions() time with defer_torsions.
+        """
+        frame = _term_frame(terms, _TERM_COLUMNS['proper'])
+        _check_periodicity(frame['periodicity'])
+        skipped = self._addTerms('proper', frame, unique=False)
+        labels = _TYPE_COLUMNS['proper']
+        touched = frame[labels[0]].str.cat([frame[l] for l in labels[1:]], 
+                                           sep='-')
+        self._pending_torsions.update(touched.values)
+        if not self.defer_torsions:
+            self.finalizeTorsions()
+        return skipped
+
+    def finalizeTorsions(self):
+        """
+        Normalize the periodicity signs of every torsion added since the last
+        call in one vectorized pass: within each group of rows with the same
+        4 types, every row but the last gets a negative periodicity, flagging
+        that more Fourier terms follow, and the last a positive one. This is
+        what _refreshProper does after each addProper; with defer_torsions
+        set it is left to this method, which printDat calls implicitly.
+        """
+        if not self._pending_torsions:
+            return
+        df = self.proper_df
+        labels = _TYPE_COLUMNS['proper']
+        keys = df[labels[0]].str.cat([df[l] for l in labels[1:]], sep='-')
+        in_group = keys.isin(list(self._pending_torsions))
+        last = ~keys.duplicated(keep='last')
+        periodicity = df['periodicity'].abs()
+        periodicity[~last] *= -1
+        df.loc[in_group, 'periodicity'] = periodicity[in_group]
+        self._pending_torsions = set()
+        self._dirty.add('proper')
+
+    def addImpropers(self, terms):
+        """
+        Bulk version of addImproper. terms has columns type1, type2, type3,
+        type4, fc, theta0 and periodicity. Only the forward sequence of types
+        is checked for existing terms.
+        """
+        frame = _term_frame(terms, _TERM_COLUMNS['improper'])
+        assert (frame['fc'] >= 0).all() and (frame['theta0'] >= 0).all(), \
+            "fc and theta0 of an improper term cannot be negative."
+        _check_periodicity(frame['periodicity'])
+        return self._addTerms('improper', frame, directional=True)
+
+    def setImpropers(self, terms):
+        """
+        Bulk version of setImproper. terms has columns type1, type2, type3,
+        type4, fc, theta0 and periodicity.
+        """
+        frame = _term_frame(terms, _TERM_COLUMNS['improper'])
+        assert (frame['fc'] >= 0).all() and (frame['theta0'] >= 0).all(), \
+            "fc and theta0 of an improper term cannot be negative."
+        _check_periodicity(frame['periodicity'])
+        return self._setTerms('improper', frame, 
+                              ['fc', 'theta0', 'periodicity'], 
+                              directional=True)
+
+    def addVdws(self, terms):
+        """
+        Bulk version of addVdw. terms has columns type, half_rmin, epsilon.
+        """
+        frame = _term_frame(terms, _TERM_COLUMNS['vdw'])
+        assert (frame['half_rmin'] >= 0).all() and \
+            (frame['epsilon'] >= 0).all(), \
+            'Rmin and epsilon of an atom cannot be negative.'
+        return self._addTerms('vdw', frame)
+
+    def setVdws(self, terms):
+        """
+        Bulk version of setVdw. terms has columns type, half_rmin, epsilon.
+        Like setVdw, every row of a type is set.
+        """
+        frame = _term_frame(terms, _TERM_COLUMNS['vdw'])
+        return self._setTerms('vdw', frame, ['half_rmin', 'epsilon'], 
+                              all_matches=True)
+
+    def cloneType(self, oldtype, newtype, overrides=None):
+        """
+        Duplicate every term involving oldtype, with newtype in its place, 
+        through the bulk add methods. A term with oldtype at several 
+        positions is cloned once per non-empty subset of them, so CT-CT 
+        cloned to NT gives NT-CT and NT-NT. overrides maps a table name to
+        the parameter values to use for all of its clones, e.g. 
+        {'vdw': {'half_rmin': 1.9, 'epsilon': 0.1}}.
+        """
+        oldtype = oldtype.replace(' ', '')
+        newtype = newtype.replace(' ', '')
+        assert 0 < len(newtype) < 3, \
+            'Atomtype must be an non-empty string with no more than two characters.'
+        if overrides is None:
+            overrides = dict()
+        for table in overrides:
+            assert table in _TYPE_COLUMNS, "Unknown term table %s." % table
+
+        add_terms = {'mass': self.addMasses, 'stretch': self.addStretches,
+                     'angle': self.addAngles, 'proper': self.addPropers, 
+                     'improper': self.addImpropers, 'vdw': self.addVdws}
+        for table, df in self.termsInvolving(oldtype).items():
+            if len(df) == 0:
+                continue
+            labels = _TYPE_COLUMNS[table]
+
+            # One vectorized substitution per subset of type positions. The
+            # clones keep the label of their source row.
+            types = df[labels].values
+            is_old = types == oldtype
+            rows = []
+            new_types = []
+            for n in range(1, 2 ** len(labels)):
+                subset = np.array([n >> i & 1 for i in range(len(labels))],
+                                  dtype=bool)
+                hits = np.flatnonzero(is_old[:, subset].all(axis=1))
+                clone_types = types[hits]
+                clone_types[:, subset] = newtype
+                rows.append(hits)
+                new_types.append(clone_types)
+            rows = np.concatenate(rows)
+            new_types = np.concatenate(new_types)
+
+            # Order the clones by source row, then group them by their new
+            # types in order of first appearance, so that the Fourier 
+            # components of every cloned torsion stay together and in order.
+            order = np.argsort(rows, kind='mergesort')
+            groups = dict()
+            group = [groups.setdefault(tuple(t), len(groups)) 
+                     for t in new_types[order]]
+            order = order[np.argsort(group, kind='mergesort')]
+            clones = df.take(rows[order]).copy()
+            new_types = new_types[order]
+            for i, l in enumerate(labels):
+                clones[l] = new_types[:, i]
+
+            # Different subsets can give the same term read backwards, e.g. 
+            # NT-CT and CT-NT, keep one of them per source row.
+            types = zip(*[clones[l].values for l in labels])
+            if table != 'improper':
+                types = [_canonical_key(t) for t in types]
+            keep = ~pd.Series(zip(clones.index, types)).duplicated().values
+            # addPropers does not skip existing torsions, as several rows 
+            # can make up one torsion.
+            if table == 'proper':
+                keep &= (self._matchTerms(table, clones) == -1).values
+            clones = clones[keep].copy()
+
+            for column, value in overrides.get(table, dict()).items():
+                assert column in _TERM_COLUMNS[table][len(labels):], \
+                    "Unknown parameter %s of %s terms." % (column, table)
+                clones[column] = value
+            clones['comment'] = ''
+            add_terms[table](clones.reset_index(drop=True))
@@ -7,6 +7,13 @@ import os, re
 import pandas as pd
 
 from StringIO import StringIO
+from amberlib import _compact_table, _parse_block, _TABLE_FORMATS
+
+# Column names of the atoms and atomspertinfo frames of AmberLib.
+_LIB_COLUMNS = {'atoms': ['name', 'type', 'typex', 'resx', 'flag', 'seq', 
+                          'elmnt', 'charge'],
+                'atomspertinfo': ['pname', 'ptype', 'ptypex', 'pelmnt', 
+                                  'pchg']}
 
 def _check_atomtype_match(df, input_types, labels):
     """
@@ -575,54 +582,65 @@ class AmberLib():
 
         self.atoms_edit_idx = []
         self.atomspertinfo_edit_idx = []
+        # Block number -> (entry name, residue name) of the blocks PrintLib
+        # writes from the frames once they are edited.
+        self._edit_blocks = dict()
+        self._edited = set()
+        tables = {'atoms': [], 'atomspertinfo': []}
         for n, block in enumerate(self.work_list):
             entry_match = entry_pattern.match(block)
             if entry_match:
                 self.work_list[n] = '!' + block
                 resi_name, entry_name = entry_match.groups()
-                if entry_name == 'atoms':
-                    self.atoms_edit_idx.append(n)
-                    self.atoms_dict[resi_name] = pd.DataFrame(
-                        columns=['name', 'type', 'typex', 'resx', 'flag', 
-                                 'seq', 'elmnt', 'charge'])
-                    atom_list = block.split('\n')[1:-1]
-                    for m, al in enumerate(atom_list):
-                        self.atoms_dict[resi_name].loc[m] = al.split(' ')[1:]
-
-                elif entry_name == 'atomspertinfo':
-                    self.atomspertinfo_edit_idx.append(n)
-                    self.atomspertinfo_dict[resi_name] = pd.DataFrame(
-                        columns=['pname', 'ptype', 'ptypex', 'pelmnt', 'pchg'])
-                    atom_list = block.split('\n')[1:-1]
-                    for m, al in enumerate(atom_list):
-                        self.atomspertinfo_dict[resi_name].loc[m] = al.split(' ')[1:]
-                else:
-                    continue
+                if entry_name in tables:
+                    getattr(self, '%s_edit_idx' % entry_name).append(n)
+                    self._edit_blocks[n] = (entry_name, resi_name)
+                    tables[entry_name].append((resi_name, block))
             else:
                 self.work_list[n] = '!!' + block
 
+        # The tables of all residues are parsed at once, with typed columns.
+        for entry_name, blocks in tables.items():
+            frames = getattr(self, '%s_dict' % entry_name)
+            columns = _LIB_COLUMNS[entry_name]
+            compact = None
+            if blocks:
+                header = blocks[0][1].split('\n', 1)[0]
+                compact = _compact_table(header.split('  ')[1:], blocks)
+            for resi_name, block in blocks:
+                if compact is not None:
+                    df = compact.frame(resi_name)
+                else:
+                    df = _parse_block(block)[2]
+                df.columns = columns
+                frames[resi_name] = df
+
+    def MarkEdited(self, resi_name, entry_name):
+        """
+        Flag the atoms or atomspertinfo block of a residue as edited, so 
+        that PrintLib writes it from its frame. SetAtomType and 
+        SetAtomCharge do this themselves; every other block is printed 
+        verbatim from work_list.
+        """
+        self._edited.add((entry_name, resi_name))
+
     def PrintLib(self, output_fh):
         for n, block in enumerate(self.work_list):
-            if n in self.atoms_edit_idx:
-                output_lines = block.split('\n')[:-1]
-                print >> output_fh, output_lines[0]
-                resname = re.search("entry\.(\w+)\.unit", block).groups()[0]
-                resi_params = self.atoms_dict[resname]
-                for _, row in resi_params.iterrows():
-                    print >> output_fh, ' %s %s %s %s %s %s %s %s' % tuple(row)
-            elif n in self.atomspertinfo_edit_idx:
-                output_lines = block.split('\n')[:-1]
-                print >> output_fh, output_lines[0]
-                resname = re.search("entry\.(\w+)\.unit", block).groups()[0]
-                resi_params = self.atomspertinfo_dict[resname]
-                for _, row in resi_params.iterrows():
-                    print >> output_fh, ' %s %s %s %s %s' % tuple(row)
-                pass
+            if self._edit_blocks.get(n) in self._edited:
+                entry_name, resname = self._edit_blocks[n]
+                df = getattr(self, '%s_dict' % entry_name)[resname]
+                row_format = _TABLE_FORMATS[entry_name]
+                output_lines = [block.split('\n', 1)[0]]
+                output_lines += [row_format % row for row in 
+                                 zip(*[df[c].values for c in df.columns])]
+                output_fh.write('\n'.join(output_lines) + '\n')
             else:
                 print >> output_fh, block, 
 
     def SetAtomType(self, resi_name, atom_name, new_type):
-        if resi_name in self.atoms_dict.keys():
+        atom_name = atom_name.strip('"')
+        new_type = new_type.strip('"')
+        if resi_name in self.atoms_dict:
             atoms_df = self.atoms_dict[resi_name]
             atomspertinfo_df = self.atomspertinfo_dict[resi_name]
 
@@ -631,17 +649,22 @@ class AmberLib():
 
             atoms_df.loc[i1, 'type'] = new_type
             atomspertinfo_df.loc[i2, 'ptype'] = new_type
+            self.MarkEdited(resi_name, 'atoms')
+            self.MarkEdited(resi_name, 'atomspertinfo')
         else:
             print '%s does not exist in %s' % (resi_name, self.inputfile)
             pass
 
     def SetAtomCharge(self, resi_name, atom_name, new_charge):
-        if resi_name in self.atoms_dict.keys():
+        atom_name = atom_name.strip('"')
+        new_charge = float(new_charge)
+        if resi_name in self.atoms_dict:
 
             atoms_df = self.atoms_dict[resi_name]
 
             i = atoms_df[atoms_df.name==atom_name].index
             atoms_df.loc[i, 'charge'] = new_charge
+            self.MarkEdited(resi_name, 'atoms')
         else:
             print '%s does not exist in %s' % (resi_name, self.inputfile)
             pass
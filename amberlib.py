@@ -4,170 +4,460 @@
 @created: September 19th, 2017
 '''
 import os, re
+from collections import OrderedDict
+import numpy as np
 import pandas as pd
+import fileio
+import parsecache
+from lookupdict import LookupDict
 
 from UserDict import IterableUserDict
 from StringIO import StringIO
 
+_HEADER_PATTERN = re.compile("entry\.(\w+)\.unit\.(\w+)")
+# Header line of an entry block, e.g. '!entry.ALA.unit.atoms table ...'
+_ENTRY_PATTERN = re.compile("^!entry\.(\w+)\.unit\.(\w+)", re.M)
+
+# Entries of a residue written by printLib, in order, with the row format of
+# the tables and the element format of the arrays and singles. An element 
+# format gets the line number and the element.
+_ENTRY_ORDER = ['atoms', 'atomspertinfo', 'boundbox', 'childsequence', 
+                'connect', 'connectivity', 'hierarchy', 'name', 'positions',
+                'residueconnect', 'residues', 'residuesPdbSequenceNumber',
+                'solventcap', 'velocities']
+_TABLE_FORMATS = {'atoms': ' "%s" "%s" %d %d %d %d %d %f',
+                  'atomspertinfo': ' "%s" "%s" %d %d %.1f',
+                  'connectivity': ' %d %d %d',
+                  'hierarchy': ' "%s" %d "%s" %d',
+                  'positions': ' %f %f %.6e',
+                  'residueconnect': ' %d %d %d %d %d %d',
+                  'residues': ' "%s" %d %d %d "%s" %d',
+                  'velocities': ' %.1f %.1f %.1f'}
+_ARRAY_FORMATS = {'boundbox': lambda n, x: ' %.1f' % float(x) if n > 1 
+                                           else ' %f' % float(x),
+                  'childsequence': lambda n, x: ' %d' % int(x),
+                  'connect': lambda n, x: ' %d' % int(x),
+                  'name': lambda n, x: ' %s' % x.replace(' ', ''),
+                  'residuesPdbSequenceNumber': lambda n, x: ' %d' % int(x),
+                  'solventcap': lambda n, x: ' %.1f' % float(x) if n > 2 
+                                             else ' %f' % float(x)}
+
+def _parse_block(block):
+    """
+    Parse one entry block of a .lib file, without its leading '!'. Returns
+    the residue name, the entry name and the entry, a DataFrame for tables
+    and the list of lines for arrays and singles.
+    """
+    resname, entryname = _HEADER_PATTERN.match(block).groups()
+    temp_list = block.split('\n')[0].split(' ')
+    if temp_list[1] == 'table':
+        header_string_list = block.split('\n')[0].split('  ')
+        #data_names = [re.search('\s(\w+)', x).groups()[0] for x in
+        #              header_string_list[1:]]
+        compact = _compact_table(header_string_list[1:], [(resname, block)])
+        if compact is not None:
+            return resname, entryname, compact.frame(resname)
+        block_csv = StringIO(block)
+        info_df = pd.read_csv(block_csv, sep='\s+', skiprows=[0], 
+                              keep_default_na=False,
+                              names=header_string_list[1:])
+        return resname, entryname, info_df
+    if temp_list[1] == 'array' or temp_list[1] == 'single':
+        return resname, entryname, block.split('\n')[:-1]
+    return resname, entryname, None
+
+# Dtypes of the table columns, by the type in front of the column name.
+_COLUMN_DTYPES = {'str': object, 'int': np.int32, 'dbl': np.float64}
+
+class _CompactTable(object):
+    """
+    One table entry of all the residues of a library that share its header,
+    stored as a single contiguous 2D array if all columns have the same 
+    numeric dtype, or as one array per column otherwise. rows maps a 
+    residue name to the (start, stop) slice of its rows.
+    """
+    def __init__(self, columns, arrays, rows):
+        self.columns = columns
+        self.rows = rows
+        dtypes = set(a.dtype for a in arrays)
+        if len(dtypes) == 1 and object not in dtypes:
+            self.values = np.column_stack(arrays)
+            self.arrays = None
+        else:
+            self.values = None
+            self.arrays = arrays
+
+    def frame(self, resname):
+        """
+        The DataFrame of a residue, a view on the 2D array if there is one.
+        """
+        start, stop = self.rows[resname]
+        if self.values is not None:
+            return pd.DataFrame(self.values[start:stop], columns=self.columns,
+                                copy=False)
+        return pd.DataFrame(OrderedDict((c, a[start:stop]) for c, a in 
+                                        zip(self.columns, self.arrays)),
+                            columns=self.columns)
+
+    def column(self, resname, column):
+        """
+        The values of one column of a residue, without building its frame.
+        """
+        start, stop = self.rows[resname]
+        n = self.columns.index(column)
+        if self.values is not None:
+            return self.values[start:stop, n]
+        return self.arrays[n][start:stop]
+
+def _unquote(field):
+    """
+    Drop the quotes around a string field the way read_csv does, keeping 
+    whatever follows the closing quote.
+    """
+    if field.startswith('"'):
+        return field[1:].replace('"', '', 1)
+    return field
+
+def _compact_table(columns, blocks):
+    """
+    Parse the blocks of a table entry, as (resname, block) pairs sharing the
+    header columns, into one _CompactTable. Returns None if a column has no
+    known dtype or a row does not split into one field per column, e.g. 
+    because of a quoted field with spaces, so that read_csv has to be used.
+    """
+    dtypes = [_COLUMN_DTYPES.get(c.split(' ')[0]) for c in columns]
+    if None in dtypes:
+        return None
+    rows = dict()
+    lines = []
+    for resname, block in blocks:
+        res_lines = [l for l in block.split('\n')[1:] if l.strip()]
+        rows[resname] = (len(lines), len(lines) + len(res_lines))
+        lines += res_lines
+    fields = [l.split() for l in lines]
+    if any(len(f) != len(columns) for f in fields):
+        return None
+
+    arrays = []
+    try:
+        for column, dtype in zip(zip(*fields), dtypes):
+            if dtype is object:
+                arrays.append(np.array([intern(_unquote(f)) for f in column],
+                                       dtype=object))
+            else:
+                arrays.append(np.array(column, dtype=np.float64).astype(dtype))
+    except ValueError:
+        return None
+    if len(lines) == 0:
+        arrays = [np.array([], dtype=dtype) for dtype in dtypes]
+    return _CompactTable(columns, arrays, rows)
+
+def _format_table(resname, entryname, df, row_format):
+    """
+    Format a table entry for printLib, the header line followed by one line
+    per row. The columns are pulled out of the frame once and zipped into 
+    rows instead of going through iterrows.
+    """
+    header = '!entry.%s.unit.%s table' % (resname, entryname) + \
+             ''.join('  %s' % c for c in df.columns) + ' '
+    columns = [df[c].values for c in df.columns]
+    return [header] + [row_format % row for row in zip(*columns)]
+
+def _format_array(lines, element_format):
+    """
+    Format an array or single entry for printLib. The first line is the 
+    header, every element after it is formatted by element_format, which 
+    gets the line number and the element.
+    """
+    return ['!%s' % lines[0]] + \
+           [element_format(n, x) for n, x in enumerate(lines) if n > 0]
+
+def _charge_column(columns):
+    """
+    The name of the charge column of an atoms table. Files written by 
+    printLib have a trailing space after the last column name.
+    """
+    for c in columns:
+        if c.strip() == 'dbl chg':
+            return c
+    raise KeyError('No charge column in %s' % list(columns))
+
+def _build_name_index(names):
+    """
+    Map every name in a Series of atom names to the labels of its rows.
+    """
+    name_index = dict()
+    for label, name in zip(names.index, names.values):
+        name_index.setdefault(name, []).append(label)
+    return name_index
+
+def _format_entry(resname, entryname, entry):
+    """
+    Format one entry of a residue for printLib as a string.
+    """
+    if entryname in _TABLE_FORMATS:
+        lines = _format_table(resname, entryname, entry, 
+                              _TABLE_FORMATS[entryname])
+    else:
+        lines = _format_array(entry, _ARRAY_FORMATS[entryname])
+    return '\n'.join(lines) + '\n'
+
+def _index_entries(raw_string):
+    """
+    Scan the content of a .lib file for its index and entry blocks. Returns
+    the residue list of the index and a dict mapping every residue to the 
+    (entry name, start, end) offsets of its entry blocks, from the '!' of 
+    the header line to the start of the next block.
+    """
+    headers = list(_ENTRY_PATTERN.finditer(raw_string))
+    index_block = raw_string[:headers[0].start()] if headers else raw_string
+    residue_list = index_block.strip('!').split('\n')[1:-1]
+    residue_list = [x.replace(' ', '') for x in residue_list]
+    residue_list = [x.replace('"', '') for x in residue_list]
+
+    entry_spans = dict((resname, []) for resname in residue_list)
+    ends = [m.start() for m in headers[1:]] + [len(raw_string)]
+    for m, end in zip(headers, ends):
+        entry_spans.setdefault(m.group(1), []).append(
+            (m.group(2), m.start(), end))
+    return residue_list, entry_spans
+
+class _ResidueEntries(LookupDict):
+    """
+    The entries of one residue of an eagerly loaded AmberLib. Tables are
+    held as the _CompactTable of the library until they are first looked 
+    up, when their DataFrame replaces the compact table and is registered 
+    in clean_entries.
+    """
+    def __init__(self, resname, clean_entries=None):
+        dict.__init__(self)
+        self.resname = resname
+        self.clean_entries = clean_entries
+
+    def __getitem__(self, entryname):
+        entry = dict.__getitem__(self, entryname)
+        if isinstance(entry, _CompactTable):
+            entry = entry.frame(self.resname)
+            dict.__setitem__(self, entryname, entry)
+            if self.clean_entries is not None:
+                self.clean_entries[(self.resname, entryname)] = entry
+        return entry
+
+    def __reduce__(self):
+        # Pickle the compact tables as they are instead of their frames.
+        return (_ResidueEntries, (self.resname,), None, None, 
+                dict.iteritems(self))
+
+class _LazyResidues(LookupDict):
+    """
+    The data of a lazily loaded AmberLib. Maps every residue name to its
+    entries, but holds the (entry name, start, end) offsets of the entry 
+    blocks of a residue in the raw file content until the residue is first
+    looked up. The parsed entries are also registered in clean_entries.
+    """
+    def __init__(self, raw_string, offsets):
+        dict.__init__(self, offsets)
+        self.raw_string = raw_string
+        self.pending = set(offsets)
+        self.clean_entries = dict()
+
+    def __getitem__(self, resname):
+        if resname in self.pending:
+            entries = dict()
+            for _, start, end in dict.__getitem__(self, resname):
+                _, entryname, entry = \
+                    _parse_block(self.raw_string[start + 1:end])
+                if entry is not None:
+                    entries[entryname] = entry
+                    self.clean_entries[(resname, entryname)] = entry
+            self[resname] = entries
+        return dict.__getitem__(self, resname)
+
+    def __setitem__(self, resname, entries):
+        self.pending.discard(resname)
+        dict.__setitem__(self, resname, entries)
+
 class AmberLib(IterableUserDict):
     """
     A class describing the .lib file in AmberFFCombo.
     """
-    def __init__(self, lib_file_path):
+    # Attributes set by loadLib, stored in the parse cache.
+    _CACHED_ATTRS = ('blocklist', 'residue_list', 'data', '_raw_string', 
+                     '_entry_spans')
+
+    def __init__(self, lib_file_path, cache=False, lazy=False):
+        """
+        With cache set to True, or to a cache directory, the parsed tables
+        are kept on disk by parsecache and reused while the file is 
+        unchanged.
+
+        With lazy, the file is only scanned for the offsets of its entry 
+        blocks, and the entries of a residue are parsed on first access. 
+        A lazily loaded file is not written to the cache.
+        """
         IterableUserDict.__init__(self)
+        self._name_index = dict()
         self.libpath = lib_file_path
         self.title = os.path.basename(self.libpath)
-        self.loadLib()
+        if not parsecache.restore(self, self.libpath, cache):
+            self.loadLib(lazy)
+            if not lazy:
+                parsecache.save(self, self.libpath, cache)
+        self._markClean()
 
     def __repr__(self):
         return '<AmberLib %s>' % self.title
 
-    def loadLib(self):
-        with open(self.libpath, 'r') as fh:
-            raw_string = fh.read()
+    def loadLib(self, lazy=False):
+        """
+        Load a .lib file into the AmberLib object. With lazy, blocklist is 
+        not kept and the entries are left to _LazyResidues.
+        """
+        raw_string = fileio.read(self.libpath)
+
+        # Keep the original text of the entry blocks, so that printLib can 
+        # copy the ones that were not modified.
+        self._raw_string = raw_string
+        self.residue_list, self._entry_spans = _index_entries(raw_string)
+
+        if lazy:
+            self.blocklist = None
+            self.data = _LazyResidues(raw_string, self._entry_spans)
+            return
+
         blocklist = raw_string.split('!')
         blocklist = filter(None, blocklist)
         self.blocklist = blocklist
 
-        self.residue_list = blocklist[0].split('\n')[1:-1]
-        self.residue_list = [x.replace(' ', '') for x in self.residue_list]
-        self.residue_list = [x.replace('"', '') for x in self.residue_list]
-
         for resname in self.residue_list:
-            self.data[resname] = dict()
+            self.data[resname] = _ResidueEntries(resname)
 
-        header_pattern = re.compile("entry\.(\w+)\.unit\.(\w+)")
+        # Tables are parsed for all residues at once, per entry and header,
+        # into compact tables.
+        tables = OrderedDict()
         for block in blocklist[1:]:
-            resname, entryname = \
-                header_pattern.match(block).groups()
-            temp_list = block.split('\n')[0].split(' ')
-            if temp_list[1] == 'table':
-                header_string_list = block.split('\n')[0].split('  ')
-                #data_names = [re.search('\s(\w+)', x).groups()[0] for x in
-                #              header_string_list[1:]]
-                block_csv = StringIO(block)
-                info_df = pd.read_csv(block_csv, sep='\s+', skiprows=[0], 
-                                      keep_default_na=False,
-                                      names=header_string_list[1:])
-                self.data[resname][entryname] = info_df
-            if temp_list[1] == 'array' or temp_list[1] == 'single':
-                self.data[resname][entryname] = block.split('\n')[:-1]
+            resname, entryname = _HEADER_PATTERN.match(block).groups()
+            header = block.split('\n', 1)[0]
+            if header.split(' ')[1] == 'table':
+                columns = tuple(header.split('  ')[1:])
+                tables.setdefault((entryname, columns), []).append(
+                    (resname, block))
+                continue
+            resname, entryname, entry = _parse_block(block)
+            if entry is not None:
+                self.data[resname][entryname] = entry
 
-    def printLib(self, out_file_path):
-        fh = open(out_file_path, 'w')
-        print >> fh, '!!index array str'
-        for r in self.residue_list:
-            print >> fh, ' "%s"' % r
-
-        for r in self.residue_list:
-
-            print >> fh, '!entry.%s.unit.atoms table' % r,
-            for c in self.data[r]['atoms'].columns:
-                print >> fh, ' %s' % c, 
-            print >> fh, ''
-            for _, row in self.data[r]['atoms'].iterrows():
-                print >> fh, ' "%s" "%s" %d %d %d %d %d %f' % tuple(row)
-
-            print >> fh, '!entry.%s.unit.atomspertinfo table' % r,
-            for c in self.data[r]['atomspertinfo'].columns:
-                print >> fh, ' %s' % c, 
-            print >> fh, ''
-            for _, row in self.data[r]['atomspertinfo'].iterrows():
-                print >> fh, ' "%s" "%s" %d %d %.1f' % tuple(row)
-
-            for n, elmnt in enumerate(self.data[r]['boundbox']):
-                if n == 0:
-                    print >> fh, '!%s' % elmnt
-                elif n > 1:
-                    print >> fh, ' %.1f' % float(elmnt) 
+        for (entryname, columns), blocks in tables.items():
+            compact = _compact_table(list(columns), blocks)
+            for resname, block in blocks:
+                if compact is not None:
+                    self.data[resname][entryname] = compact
                 else:
-                    print >> fh, ' %f' % float(elmnt) 
+                    self.data[resname][entryname] = _parse_block(block)[2]
 
-            for n, elmnt in enumerate(self.data[r]['childsequence']):
-                if n == 0:
-                    print >> fh, '!%s' % elmnt
-                else:
-                    print >> fh, ' %d' % int(elmnt) 
+    def _markClean(self):
+        """
+        Forget about all modifications, i.e. treat the entries as they are 
+        now as the ones read from the file.
+        """
+        self._modified = set()
+        self._clean_residue_list = list(self.residue_list)
+        self._clean_entries = dict()
+        pending = getattr(self.data, 'pending', set())
+        for resname, entries in dict.items(self.data):
+            if resname in pending:
+                continue
+            if isinstance(entries, _ResidueEntries):
+                entries.clean_entries = self._clean_entries
+            for entryname, entry in dict.items(entries):
+                self._clean_entries[(resname, entryname)] = entry
+        if isinstance(self.data, _LazyResidues):
+            self.data.clean_entries = self._clean_entries
 
-            for n, elmnt in enumerate(self.data[r]['connect']):
-                if n == 0:
-                    print >> fh, '!%s' % elmnt
-                else:
-                    print >> fh, ' %d' % int(elmnt) 
-
-            print >> fh, '!entry.%s.unit.connectivity table' % r,
-            for c in self.data[r]['connectivity'].columns:
-                print >> fh, ' %s' % c, 
-            print >> fh, ''
-            for _, row in self.data[r]['connectivity'].iterrows():
-                print >> fh, ' %d %d %d' % tuple(row)
-
-            print >> fh, '!entry.%s.unit.hierarchy table' % r,
-            for c in self.data[r]['hierarchy'].columns:
-                print >> fh, ' %s' % c, 
-            print >> fh, ''
-            for _, row in self.data[r]['hierarchy'].iterrows():
-                print >> fh, ' "%s" %d "%s" %d' % tuple(row)
-
-            for n, elmnt in enumerate(self.data[r]['name']):
-                if n == 0:
-                    print >> fh, '!%s' % elmnt
-                else:
-                    print >> fh, ' %s' % elmnt.replace(' ', '') 
-
-            print >> fh, '!entry.%s.unit.positions table' % r,
-            for c in self.data[r]['positions'].columns:
-                print >> fh, ' %s' % c, 
-            print >> fh, ''
-            for _, row in self.data[r]['positions'].iterrows():
-                print >> fh, ' %f %f %.6e' % tuple(row)
-
-            print >> fh, '!entry.%s.unit.residueconnect table' % r,
-            for c in self.data[r]['residueconnect'].columns:
-                print >> fh, ' %s' % c, 
-            print >> fh, ''
-            for _, row in self.data[r]['residueconnect'].iterrows():
-                print >> fh, ' %d %d %d %d %d %d' % tuple(row)
-
-            print >> fh, '!entry.%s.unit.residues table' % r,
-            for c in self.data[r]['residues'].columns:
-                print >> fh, ' %s' % c, 
-            print >> fh, ''
-            for _, row in self.data[r]['residues'].iterrows():
-                print >> fh, ' "%s" %d %d %d "%s" %d' % tuple(row)
-
-            for n, elmnt in enumerate(self.data[r]['residuesPdbSequenceNumber']):
-                if n == 0:
-                    print >> fh, '!%s' % elmnt
-                else:
-                    print >> fh, ' %d' % int(elmnt) 
+    def markModified(self, resname, entryname):
+        """
+        Flag an entry of a residue as modified, so that printLib reformats
+        it instead of copying it from the source file. The edit methods do
+        this themselves, it is only needed after editing an entry in place.
+        The atom name index of the entry is dropped, as the edit may have 
+        renamed atoms.
+        """
+        self._modified.add((resname, entryname))
+        self._name_index.pop((resname, entryname), None)
 
-            for n, elmnt in enumerate(self.data[r]['solventcap']):
-                if n == 0:
-                    print >> fh, '!%s' % elmnt
-                elif n > 2:
-                    print >> fh, ' %.1f' % float(elmnt) 
-                else:
-                    print >> fh, ' %f' % float(elmnt) 
+    def _verbatimEntry(self, resname, entryname, entries):
+        """
+        Return the original text of an entry, or None if it has to be 
+        reformatted because it was modified or replaced. entries is None 
+        for residues a lazy load has not parsed yet, which are untouched.
+        """
+        if (resname, entryname) in self._modified:
+            return None
+        if entries is not None and \
+                dict.get(entries, entryname) is not \
+                self._clean_entries.get((resname, entryname)):
+            return None
+        for name, start, end in self._entry_spans.get(resname, []):
+            if name == entryname:
+                return self._raw_string[start:end]
+        return None
 
-            print >> fh, '!entry.%s.unit.velocities table' % r,
-            for c in self.data[r]['velocities'].columns:
-                print >> fh, ' %s' % c, 
-            print >> fh, ''
-            for _, row in self.data[r]['velocities'].iterrows():
-                print >> fh, ' %.1f %.1f %.1f' % tuple(row)
+    def printLib(self, out_file_path):
+        """
+        Print out an AmberLib object. Entries that were not modified since
+        loading are copied from the source file, the others are formatted 
+        column-wise. Every residue is written to the file in one piece. The
+        file is compressed if out_file_path ends with .gz, .bz2 or .xz.
+        """
+        pending = getattr(self.data, 'pending', set())
+        with fileio.open_output(out_file_path) as fh:
+            starts = [start for spans in self._entry_spans.values()
+                      for _, start, _ in spans]
+            if self.residue_list == self._clean_residue_list and starts:
+                fh.write(self._raw_string[:min(starts)])
+            else:
+                lines = ['!!index array str']
+                lines += [' "%s"' % r for r in self.residue_list]
+                fh.write('\n'.join(lines) + '\n')
+
+            for r in self.residue_list:
+                entries = None if r in pending else self.data[r]
+                blocks = []
+                for entryname in _ENTRY_ORDER:
+                    block = self._verbatimEntry(r, entryname, entries)
+                    if block is None:
+                        block = _format_entry(r, entryname, 
+                                              self.data[r][entryname])
+                    blocks.append(block)
+                fh.write(''.join(blocks))
 
         print "Printed %s to %s" % (self, out_file_path)
 
+    def _nameIndex(self, resname, entryname):
+        """
+        Return the atom name index of the atoms or atomspertinfo table of a
+        residue, (re)building it when the table has been replaced or 
+        resized.
+        """
+        df = self.data[resname][entryname]
+        signature = (id(df), len(df))
+        key = (resname, entryname)
+        if key not in self._name_index or \
+                self._name_index[key][0] != signature:
+            name_column = 'str name' if entryname == 'atoms' else 'str pname'
+            self._name_index[key] = \
+                (signature, _build_name_index(df[name_column]))
+        return self._name_index[key][1]
+
     def setAtomType(self, resname, atomname, newtype):
         resname = resname.replace(' ', '')
         atomname = atomname.replace(' ', '')
         newtype = newtype.replace(' ', '')
         assert 0 < len(newtype) < 3, \
             "Atomtype must be a non-empty string with no more than two characters."
-        if resname in self.data.keys():
+        if resname in self.data:
             atm_df = self.data[resname]['atoms']
-            atm_idx = atm_df.index[atm_df['str name'] == atomname]
+            atm_idx = self._nameIndex(resname, 'atoms').get(atomname, [])
             if len(atm_idx) == 0:
                 print '%s does not exist in residue %s in %s, no atomtype set' \
                     % (atomname, resname, self)
@@ -175,38 +465,309 @@ class AmberLib(IterableUserDict):
             atm_df.loc[atm_idx, 'str type'] = newtype
 
             atmpert_df = self.data[resname]['atomspertinfo']
-            atmpert_idx = atmpert_df.index[atmpert_df['str pname'] == atomname]
+            atmpert_idx = \
+                self._nameIndex(resname, 'atomspertinfo').get(atomname, [])
             atmpert_df.loc[atmpert_idx, 'str ptype'] = newtype
+            self._modified.update([(resname, 'atoms'), 
+                                   (resname, 'atomspertinfo')])
             print 'The type of %s in residue %s is set to be %s' \
                 % (atomname, resname, newtype)
         else:
             print '%s does not exist in %s, no atomtype set' % (resname, self)
 
+    def retypeAtoms(self, type_map, residues=None):
+        """
+        Bulk version of setAtomType. type_map maps old atomtypes to new ones,
+        which are assigned to every matching atom of residues, all residues
+        by default, with one vectorized replacement per residue. Returns the
+        number of atoms retyped.
+        """
+        type_map = dict((old.replace(' ', ''), new.replace(' ', ''))
+                        for old, new in type_map.items())
+        for newtype in type_map.values():
+            assert 0 < len(newtype) < 3, \
+                "Atomtype must be a non-empty string with no more than two characters."
+        if residues is None:
+            residues = self.residue_list
+
+        count = 0
+        for resname in residues:
+            resname = resname.replace(' ', '')
+            if resname not in self.data:
+                print '%s does not exist in %s, no atomtype set' \
+                    % (resname, self)
+                continue
+            atm_df = self.data[resname]['atoms']
+            retyped = atm_df['str type'].isin(type_map.keys())
+            if not retyped.any():
+                continue
+            atm_df.loc[retyped, 'str type'] = \
+                atm_df.loc[retyped, 'str type'].map(type_map)
+
+            new_types = dict(zip(atm_df.loc[retyped, 'str name'], 
+                                 atm_df.loc[retyped, 'str type']))
+            atmpert_df = self.data[resname]['atomspertinfo']
+            atmpert_idx = atmpert_df['str pname'].isin(new_types.keys())
+            atmpert_df.loc[atmpert_idx, 'str ptype'] = \
+                atmpert_df.loc[atmpert_idx, 'str pname'].map(new_types)
+            self._modified.update([(resname, 'atoms'), 
+                                   (resname, 'atomspertinfo')])
+            count += retyped.sum()
+
+        print '%d atoms retyped in %s' % (count, self)
+        return count
+
     def setAtomCharge(self, resname, atomname, newcharge):
         resname = resname.replace(' ', '')
         atomname = atomname.replace(' ', '')
         assert isinstance(newcharge, (float, int)), \
             "Charge must be a number."
-        if resname in self.data.keys():
+        if resname in self.data:
             atm_df = self.data[resname]['atoms']
-            atm_idx = atm_df.index[atm_df['str name'] == atomname]
+            atm_idx = self._nameIndex(resname, 'atoms').get(atomname, [])
             if len(atm_idx) == 0:
                 print '%s does not exist in residue %s in %s, no charge set' \
                     % (atomname, resname, self)
                 return
-            atm_df.loc[atm_idx, 'dbl chg'] = newcharge
+            atm_df.loc[atm_idx, _charge_column(atm_df.columns)] = newcharge
+            self._modified.add((resname, 'atoms'))
 
             print 'The charge of %s in residue %s is set to be %f' \
                 % (atomname, resname, newcharge)
         else:
             print '%s does not exist in %s, no atomtype set' % (resname, self)
 
+    def applyAtomAssignments(self, assignments):
+        """
+        Bulk version of setAtomType and setAtomCharge for the whole library.
+        assignments is a DataFrame or an iterable of rows with columns 
+        resname, atomname, type and charge; a DataFrame may leave out type
+        or charge. The rows are joined to the atoms through the atom name 
+        index and every residue is updated in one assignment, later rows 
+        winning over earlier ones. Returns the rows whose residue or atom 
+        does not exist.
+        """
+        if isinstance(assignments, pd.DataFrame):
+            frame = assignments.reset_index(drop=True)
+        else:
+            frame = pd.DataFrame([list(a) for a in assignments], 
+                                 columns=['resname', 'atomname', 'type', 
+                                          'charge'])
+        set_type = 'type' in frame.columns
+        set_charge = 'charge' in frame.columns
+        resnames = [r.replace(' ', '') for r in frame['resname'].values]
+        atomnames = [a.replace(' ', '') for a in frame['atomname'].values]
+        if set_type:
+            types = [t.replace(' ', '') for t in frame['type'].values]
+            assert all(0 < len(t) < 3 for t in types), \
+                "Atomtype must be a non-empty string with no more than two characters."
+
+        # Join on (resname, atomname), collecting the matched rows of every
+        # residue in order.
+        matched = []
+        rows = dict()
+        for n, (resname, atomname) in enumerate(zip(resnames, atomnames)):
+            if resname in self.data and \
+                    atomname in self._nameIndex(resname, 'atoms'):
+                matched.append(n)
+                rows.setdefault(resname, []).append(n)
+
+        for resname, res_rows in rows.items():
+            # Row of the atoms table -> row of the assignments
+            atm_index = self._nameIndex(resname, 'atoms')
+            sources = dict()
+            for n in res_rows:
+                for label in atm_index[atomnames[n]]:
+                    sources[label] = n
+            atm_idx = sources.keys()
+            sources = sources.values()
+
+            atm_df = self.data[resname]['atoms']
+            if set_charge:
+                atm_df.loc[atm_idx, _charge_column(atm_df.columns)] = \
+                    frame['charge'].values[sources]
+            self._modified.add((resname, 'atoms'))
+            if not set_type:
+                continue
+            atm_df.loc[atm_idx, 'str type'] = [types[n] for n in sources]
+
+            atmpert_index = self._nameIndex(resname, 'atomspertinfo')
+            new_ptypes = dict()
+            for n in sources:
+                for label in atmpert_index.get(atomnames[n], []):
+                    new_ptypes[label] = types[n]
+            if new_ptypes:
+                atmpert_df = self.data[resname]['atomspertinfo']
+                atmpert_df.loc[new_ptypes.keys(), 'str ptype'] = \
+                    new_ptypes.values()
+                self._modified.add((resname, 'atomspertinfo'))
+
+        unmatched = frame.drop(matched)
+        print '%d atom assignments applied to %s, %d unmatched.' \
+            % (len(matched), self, len(unmatched))
+        return unmatched
+
+    def _atomCharges(self, resname):
+        """
+        The charges of the atoms table of a residue, taken straight from 
+        the compact table if its frame has not been built yet.
+        """
+        entries = self.data[resname]
+        entry = dict.get(entries, 'atoms')
+        if isinstance(entry, _CompactTable):
+            return entry.column(resname, _charge_column(entry.columns))
+        atm_df = entries['atoms']
+        return atm_df[_charge_column(atm_df.columns)].values
+
+    def chargeSummary(self, tolerance=1e-4, residues=None):
+        """
+        Net charges of residues, all residues by default, summed in one 
+        grouped reduction over the charges of the whole library. Returns a 
+        frame indexed by residue name with the number of atoms, the net 
+        charge, the nearest integer charge, the residual between the two and
+        whether the residual exceeds tolerance.
+        """
+        if residues is None:
+            residues = self.residue_list
+        residues = [r.replace(' ', '') for r in residues]
+        missing = [r for r in residues if r not in self.data]
+        for resname in missing:
+            print '%s does not exist in %s, no net charge calculated' \
+                % (resname, self)
+        residues = [r for r in residues if r in self.data]
+
+        charges = [self._atomCharges(r) for r in residues]
+        natoms = np.array([len(c) for c in charges], dtype=int)
+        groups = np.repeat(np.arange(len(residues)), natoms)
+        all_charges = np.concatenate(charges) if charges else np.array([])
+        net_charge = np.bincount(groups, weights=all_charges, 
+                                 minlength=len(residues))
+        target = np.round(net_charge)
+
+        summary = pd.DataFrame(OrderedDict([('natoms', natoms),
+                                            ('charge', net_charge),
+                                            ('target', target),
+                                            ('residual', net_charge - target)]),
+                               index=pd.Index(residues, name='resname'))
+        summary['flagged'] = summary['residual'].abs() > tolerance
+        return summary
+
+    def neutralizeCharges(self, atoms=None, tolerance=1e-4, residues=None):
+        """
+        Bring the net charge of every residue flagged by chargeSummary back 
+        to its nearest integer, by spreading the residual evenly over the 
+        atoms of the residue. atoms maps residue names to the names of the 
+        atoms that take the correction; residues left out of it, or all 
+        residues if atoms is None, spread it over all their atoms. Each 
+        residue is corrected in one assignment. Returns the chargeSummary 
+        after the correction.
+        """
+        atoms = dict((r.replace(' ', ''), [a.replace(' ', '') for a in names])
+                     for r, names in (atoms or {}).items())
+        summary = self.chargeSummary(tolerance, residues)
+
+        count = 0
+        for resname, residual in summary.loc[summary['flagged'], 
+                                             'residual'].iteritems():
+            atm_df = self.data[resname]['atoms']
+            if resname in atoms:
+                name_index = self._nameIndex(resname, 'atoms')
+                atm_idx = [label for name in atoms[resname] 
+                           for label in name_index.get(name, [])]
+            else:
+                atm_idx = list(atm_df.index)
+            if len(atm_idx) == 0:
+                print 'No atoms to correct the charge of residue %s in %s' \
+                    % (resname, self)
+                continue
+            charge_column = _charge_column(atm_df.columns)
+            atm_df.loc[atm_idx, charge_column] -= residual / len(atm_idx)
+            self._modified.add((resname, 'atoms'))
+            count += 1
+
+        print 'Net charge of %d residues corrected in %s' % (count, self)
+        return self.chargeSummary(tolerance, residues)
+
     def calcNetCharge(self, resname):
         resname = resname.replace(' ', '')
-        if resname in self.data.keys():
+        if resname in self.data:
             atm_df = self.data[resname]['atoms']
-            net_charge = atm_df['dbl chg'].sum()
+            net_charge = atm_df[_charge_column(atm_df.columns)].sum()
             return net_charge
         else:
             print '%s does not exist in %s, no net charge calculated' % (resname, self)
             return None
+
+def iterLibResidues(lib_file_path):
+    """
+    Iterate over the residues of a .lib file as (residue name, entries) 
+    pairs, in file order, with the entries parsed as by AmberLib. The file is
+    read line by line and only the blocks of the current residue are held, 
+    so memory stays bounded by the largest residue rather than the library.
+    """
+    def parse_residue(resname, blocks):
+        entries = dict()
+        for block in blocks:
+            _, entryname, entry = _parse_block(block)
+            if entry is not None:
+                entries[entryname] = entry
+        return resname, entries
+
+    current = None
+    blocks = []
+    block_lines = None
+    with fileio.open_input(lib_file_path) as fh:
+        for line in fh:
+            if line.startswith('!'):
+                if block_lines is not None:
+                    blocks.append(''.join(block_lines))
+                block_lines = None
+                m = _ENTRY_PATTERN.match(line)
+                if m is None:
+                    continue # The index block
+                if m.group(1) != current:
+                    if current is not None:
+                        yield parse_residue(current, blocks)
+                    current = m.group(1)
+                    blocks = []
+                block_lines = [line[1:]]
+            elif block_lines is not None:
+                block_lines.append(line)
+        if block_lines is not None:
+            blocks.append(''.join(block_lines))
+    if current is not None:
+        yield parse_residue(current, blocks)
+
+def extractResidues(src_lib_path, names, dst_lib_path):
+    """
+    Write the residues in names, in that order, from one .lib file to a new 
+    one, without parsing any of their entries. The entry blocks of the 
+    source are located once and copied as they are, after a new index. 
+    Residues missing from the source are skipped. Returns the list of 
+    residues written.
+    """
+    raw_string = fileio.read(src_lib_path)
+    _, entry_spans = _index_entries(raw_string)
+
+    residue_list = []
+    for resname in names:
+        resname = resname.replace(' ', '')
+        if resname in residue_list:
+            continue
+        if not entry_spans.get(resname):
+            print '%s does not exist in %s, not extracted' \
+                % (resname, src_lib_path)
+            continue
+        residue_list.append(resname)
+
+    with fileio.open_output(dst_lib_path) as fh:
+        lines = ['!!index array str']
+        lines += [' "%s"' % r for r in residue_list]
+        fh.write('\n'.join(lines) + '\n')
+        for resname in residue_list:
+            fh.write(''.join(raw_string[start:end] 
+                             for _, start, end in entry_spans[resname]))
+
+    print "Extracted %d residues from %s to %s" \
+        % (len(residue_list), src_lib_path, dst_lib_path)
+    return residue_list
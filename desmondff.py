@@ -4,36 +4,318 @@
 @created: September 22th, 2017
 '''
 import os, re, json
+import numpy as np
+from itertools import combinations
 from glob import glob
 from UserDict import IterableUserDict
+import fileio
+from lookupdict import LookupDict
+
+_CHUNK_SIZE = 64 * 1024
+_WHITESPACE = re.compile(r'[\s,]*')
+
+def _clean_element(elmnt):
+    """
+    Split the space-separated type of a term into a list.
+    """
+    if isinstance(elmnt, dict) and 'type' in elmnt and \
+            not isinstance(elmnt['type'], (tuple, list)):
+        elmnt['type'] = elmnt['type'].split(' ')
+    return elmnt
+
+def _iter_json_list(fh, first_chunk=''):
+    """
+    Decode a JSON list from a file object element by element, reading it in
+    chunks, so that only the current element and the unread part of the 
+    chunk are held as text.
+    """
+    decoder = json.JSONDecoder()
+    buf = first_chunk.lstrip()
+    assert buf.startswith('['), "Not a JSON list."
+    pos = 1
+    eof = False
+    while True:
+        pos = _WHITESPACE.match(buf, pos).end()
+        if pos < len(buf) and buf[pos] == ']':
+            return
+        try:
+            element, end = decoder.raw_decode(buf, pos)
+            # A number at the end of the buffer may continue in the next 
+            # chunk.
+            complete = end < len(buf) or eof
+        except ValueError:
+            if eof:
+                raise
+            complete = False
+        if complete:
+            yield element
+            pos = end
+            continue
+        chunk = fh.read(_CHUNK_SIZE)
+        eof = not chunk
+        buf = buf[pos:] + chunk
+        pos = 0
+
+# Schema of the term tables that can be held as a TermTable, the number of
+# types of a term and the names of its params, in column order.
+_TERM_SCHEMAS = {'mass': (1, ('amu',)),
+                 'vdw1': (1, ('sigma', 'epsilon')),
+                 'stretch_harm': (2, ('r0', 'fc')),
+                 'angle_harm': (3, ('theta0', 'fc')),
+                 'dihedral_trig': (4, ('phi0', 'fc0', 'fc1', 'fc2', 'fc3', 
+                                       'fc4', 'fc5', 'fc6')),
+                 'improper_trig': (4, ('phi0', 'fc0', 'fc1', 'fc2', 'fc3', 
+                                       'fc4', 'fc5', 'fc6')),
+                 'virtuals_lc3': (4, ('c1', 'c2'))}
+
+class TermTable(object):
+    """
+    A viparr term table held as a list of type tuples of interned strings,
+    an (n, len(param_names)) float array of params and a list of memos, 
+    instead of one JSON dict per term. Iterating over it, or indexing it, 
+    gives the terms in their JSON form; slicing it gives a list of them.
+    """
+    def __init__(self, name, types, params, memos):
+        self.name = name
+        self.ntypes, self.param_names = _TERM_SCHEMAS[name]
+        self.types = types
+        self.params = params
+        self.memos = memos
+
+    def __repr__(self):
+        return '<TermTable %s, %d terms>' % (self.name, len(self))
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, n):
+        # A slice gives a list of terms, as it does for the JSON form.
+        if isinstance(n, slice):
+            return [self[i] for i in xrange(*n.indices(len(self)))]
+        return {'type': [t.decode('utf-8') for t in self.types[n]],
+                'params': dict(zip(self.param_names, 
+                                   self.params[n].tolist())),
+                'memo': self.memos[n]}
+
+    def __iter__(self):
+        for n in xrange(len(self)):
+            yield self[n]
+
+    def column(self, param_name):
+        """
+        The values of one param of all terms.
+        """
+        return self.params[:, self.param_names.index(param_name)]
+
+    @classmethod
+    def fromJSON(cls, name, elements):
+        """
+        Build the TermTable of an iterable of terms in JSON form, with 
+        their types split. Returns None if the table has no schema or a term does
+        not fit it exactly, so that nothing would be lost converting back.
+        """
+        if name not in _TERM_SCHEMAS:
+            return None
+        ntypes, param_names = _TERM_SCHEMAS[name]
+        keys = set(['type', 'params', 'memo'])
+        types, params, memos = [], [], []
+        for elmnt in elements:
+            if set(elmnt) != keys or len(elmnt['type']) != ntypes or \
+                    len(elmnt['params']) != len(param_names):
+                return None
+            try:
+                values = [elmnt['params'][p] for p in param_names]
+            except KeyError:
+                return None
+            if any(type(v) is not float for v in values):
+                return None
+            types.append(tuple(intern(t.encode('utf-8')) 
+                               for t in elmnt['type']))
+            params.append(values)
+            memos.append(elmnt['memo'])
+        params = np.array(params, dtype=np.float64).reshape(
+            len(params), len(param_names))
+        return cls(name, types, params, memos)
+
+    def toJSON(self):
+        """
+        The terms in JSON form, as loaded by a plain DesmondFF.
+        """
+        return list(self)
+
+def _load_table(file_path, name=None, compact=False):
+    """
+    Load one viparr file. List tables are decoded element by element, with
+    their types split as they come; anything else is loaded in one go. With
+    compact, a term table that fits its schema is built into a TermTable 
+    straight from the stream, and otherwise read again as a list.
+    """
+    if compact and name in _TERM_SCHEMAS:
+        with fileio.open_input(file_path) as fh:
+            chunk = fh.read(_CHUNK_SIZE)
+            if chunk.lstrip().startswith('['):
+                table = TermTable.fromJSON(name, (_clean_element(e) for e in
+                                           _iter_json_list(fh, chunk)))
+                if table is not None:
+                    return table
+
+    with fileio.open_input(file_path) as fh:
+        chunk = fh.read(_CHUNK_SIZE)
+        if chunk.lstrip().startswith('['):
+            return [_clean_element(e) for e in _iter_json_list(fh, chunk)]
+        return json.loads(chunk + fh.read())
+
+def _build_lookup_index(types):
+    """
+    Map the type tuple of every term to the list of rows that have it, in 
+    table order. A tuple has several rows when its term has several 
+    components, e.g. the terms of a multi-term torsion.
+    """
+    index = dict()
+    for n, term_types in enumerate(types):
+        index.setdefault(tuple(term_types), []).append(n)
+    return index
+
+def _resolve(index, types):
+    """
+    The rows of the terms matching types, following viparr: an exact match, 
+    forward or reversed, first, then patterns with more and more '*' 
+    wildcards in place of types. Among the matching patterns with the same 
+    number of wildcards, the one first in the table wins, and all of its 
+    rows are returned. Returns an empty list if nothing matches.
+    """
+    types = tuple(types)
+    candidates = [types]
+    if len(types) > 1 and types[::-1] != types:
+        candidates.append(types[::-1])
+    for nwild in range(len(types) + 1):
+        matches = []
+        for candidate in candidates:
+            for wild in combinations(range(len(types)), nwild):
+                pattern = tuple('*' if n in wild else t 
+                                for n, t in enumerate(candidate))
+                if pattern in index:
+                    matches.append(index[pattern])
+        if matches:
+            return min(matches)
+    return []
+
+class _LazyTables(LookupDict):
+    """
+    The data of a DesmondFF. Maps every file name of the viparr directory to
+    its table, but holds the path of the file until the table is first 
+    looked up.
+    """
+    def __init__(self, paths, compact=False):
+        dict.__init__(self, paths)
+        self.pending = set(paths)
+        self.compact = compact
+
+    def __getitem__(self, filename):
+        if filename in self.pending:
+            self[filename] = _load_table(dict.__getitem__(self, filename),
+                                         filename, self.compact)
+        return dict.__getitem__(self, filename)
+
+    def __setitem__(self, filename, table):
+        self.pending.discard(filename)
+        dict.__setitem__(self, filename, table)
 
 class DesmondFF(IterableUserDict):
     """
     A class describing the Desmond force field format.
     """
-    def __init__(self, ff_dir_path):
+    def __init__(self, ff_dir_path, compact=False):
+        """
+        With compact, the term tables are held as TermTables instead of 
+        lists of JSON dicts.
+        """
         IterableUserDict.__init__(self)
         self.ff_dir = ff_dir_path
         self.title = os.path.basename(self.ff_dir)
+        self.compact = compact
+        self._lookup_index = dict()
         self.loadDir()
     
     def loadDir(self):
+        """
+        Index the files of the viparr directory. Each table is only read 
+        when it is first accessed, e.g. as ff['mass'].
+        """
         ff_file_list = glob(os.path.join(self.ff_dir, '*'))
-        for file in ff_file_list:
-            filename = os.path.basename(file)
-            with open(file, 'r') as fh:
-                json_object = json.load(fh)
-                self.data[filename] = json_object
-        self._cleantype()
-
-    def _cleantype(self):
-        for filename, json_object in self.data.iteritems():
-            if isinstance(json_object, list):
-                for elmnt in json_object:
-                    if not isinstance(elmnt['type'], (tuple, list)):
-                        elmnt['type'] = elmnt['type'].split(' ')
+        # Compressed files are read as streams, under their plain name.
+        self.data = _LazyTables(dict((fileio.basename(f), f) 
+                                     for f in ff_file_list), self.compact)
+
+    def toJSON(self, filename):
+        """
+        A table in its JSON form, whether or not it is held as a TermTable.
+        """
+        table = self[filename]
+        if isinstance(table, TermTable):
+            return table.toJSON()
+        return table
+
+    def markModified(self, filename):
+        """
+        Drop the lookup index of a table, which is only rebuilt by itself 
+        when the table is replaced or resized. Needed after editing the 
+        types of a table in place.
+        """
+        self._lookup_index.pop(filename, None)
+
+    def _lookupIndex(self, filename):
+        """
+        Return the type tuple index of a term table, (re)building it when 
+        the table has been replaced or resized.
+        """
+        table = self[filename]
+        signature = (id(table), len(table))
+        if filename not in self._lookup_index or \
+                self._lookup_index[filename][0] != signature:
+            if isinstance(table, TermTable):
+                types = table.types
             else:
-                continue
+                types = [elmnt['type'] for elmnt in table]
+            self._lookup_index[filename] = \
+                (signature, _build_lookup_index(types))
+        return self._lookup_index[filename][1]
+
+    def lookup(self, filename, types):
+        """
+        The terms of a table matching a type or tuple of types, with 
+        viparr's match order: exact, forward or reversed, first, then 
+        wildcard patterns from the most to the least specific. Returns 
+        every term of the winning pattern, e.g. all the components of a 
+        multi-term torsion, in table order, or an empty list if no term 
+        matches.
+        """
+        if isinstance(types, basestring):
+            types = types.split(' ')
+        table = self[filename]
+        return [table[row] for row in 
+                _resolve(self._lookupIndex(filename), types)]
+
+    def lookupMany(self, filename, types_list):
+        """
+        Vectorized lookup. types_list is a sequence, or 2D array, of type 
+        tuples; each distinct tuple is resolved once. Returns rows and 
+        offsets, int arrays: the matching rows of the table for the nth 
+        tuple are rows[offsets[n]:offsets[n+1]], empty where nothing 
+        matches, and rows can take the params of a TermTable in one go.
+        """
+        index = self._lookupIndex(filename)
+        resolved = dict()
+        matches = []
+        for types in types_list:
+            types = tuple(types)
+            if types not in resolved:
+                resolved[types] = _resolve(index, types)
+            matches.append(resolved[types])
+        offsets = np.zeros(len(matches) + 1, dtype=int)
+        offsets[1:] = np.cumsum([len(m) for m in matches])
+        rows = np.array([row for m in matches for row in m], dtype=int)
+        return rows, offsets
 
     def _find_atomtype_inconsistency(self):
         for filename in self.data.keys():
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+'''
+@author: Dazhi Tan
+@created: October 18th, 2026
+'''
+import os, gzip, bz2
+
+# xz needs lzma, which is only in the standard library from Python 3.3 on.
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+# Leading bytes of the compressed formats that are read transparently.
+_MAGIC = [('\x1f\x8b', 'gz'), ('BZh', 'bz2'), ('\xfd7zXZ\x00', 'xz')]
+COMPRESSED_EXTENSIONS = ('.gz', '.bz2', '.xz')
+
+def compression(file_path):
+    """
+    The compression of a file, 'gz', 'bz2' or 'xz', detected by its magic
+    bytes, or None for a plain file.
+    """
+    with open(file_path, 'rb') as fh:
+        head = fh.read(6)
+    for magic, kind in _MAGIC:
+        if head.startswith(magic):
+            return kind
+    return None
+
+def _open(file_path, kind, mode):
+    if kind == 'gz':
+        return gzip.GzipFile(file_path, mode)
+    if kind == 'bz2':
+        return bz2.BZ2File(file_path, mode)
+    if kind == 'xz':
+        assert lzma is not None, \
+            "Reading or writing %s needs lzma (backports.lzma on Python 2)." \
+            % file_path
+        return lzma.LZMAFile(file_path, mode)
+    return open(file_path, mode)
+
+def open_input(file_path):
+    """
+    Open a file for reading, decompressing it on the fly if it is gzip,
+    bzip2 or xz compressed.
+    """
+    return _open(file_path, compression(file_path), 'rb')
+
+def open_output(file_path):
+    """
+    Open a file for writing, compressed according to its extension, .gz,
+    .bz2 or .xz, or plain otherwise.
+    """
+    extension = os.path.splitext(file_path)[1]
+    kind = extension[1:] if extension in COMPRESSED_EXTENSIONS else None
+    return _open(file_path, kind, 'wb')
+
+def read(file_path):
+    """
+    The whole, decompressed, content of a file.
+    """
+    with open_input(file_path) as fh:
+        return fh.read()
+
+def basename(file_path):
+    """
+    The basename of a file, without its compression extension if it is
+    compressed, e.g. 'mass' for a gzipped viparr file 'mass.gz'.
+    """
+    name = os.path.basename(file_path)
+    root, extension = os.path.splitext(name)
+    if extension in COMPRESSED_EXTENSIONS and compression(file_path):
+        return root
+    return name
@@ -8,6 +8,7 @@ from lxml import etree
 from lxml.etree import ElementBase
 from lxml.etree import XPath
 from glob import glob
+import fileio
 
 def check_duplicates(parent, tag, **kwargs):
     """
@@ -28,7 +29,8 @@ def load_viparr_dir(viparr_dir):
     viparr_json_dict = dict()
     for vf in viparr_file_list:
         abspath = os.path.abspath(vf)
-        basename = os.path.basename(abspath)
-        json_object = json.load(open(abspath, 'r'))
+        basename = fileio.basename(abspath)
+        with fileio.open_input(abspath) as fh:
+            json_object = json.load(fh)
         viparr_json_dict[basename] = json_object
     return viparr_json_dict
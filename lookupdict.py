@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+'''
+@author: Dazhi Tan
+@created: October 18th, 2026
+'''
+
+class LookupDict(dict):
+    """
+    A dict whose get, values and items go through __getitem__, so that a 
+    subclass only has to override the latter to turn stored placeholders
+    into entries.
+    """
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def itervalues(self):
+        for key in self:
+            yield self[key]
+
+    def iteritems(self):
+        for key in self:
+            yield key, self[key]
+
+    def values(self):
+        return list(self.itervalues())
+
+    def items(self):
+        return list(self.iteritems())
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+'''
+@author: Dazhi Tan
+@created: October 18th, 2026
+'''
+import os, hashlib, tempfile
+import cPickle as pickle
+import pandas as pd
+from glob import glob
+
+# Bump whenever the parsed layout of AmberDat or AmberLib changes, so that
+# entries written by older code are rebuilt instead of restored.
+CACHE_VERSION = 5
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache',
+                                 'ff_tools')
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+def _cache_dir(cache):
+    """
+    cache is either True, for the default location, or a directory path.
+    """
+    if cache is True:
+        return os.environ.get('FF_TOOLS_CACHE_DIR', DEFAULT_CACHE_DIR)
+    return cache
+
+def _entry_path(cache_dir, kind, file_path):
+    """
+    One entry per (kind, file) pair, so that a stale entry is overwritten
+    by its rebuild instead of piling up next to it.
+    """
+    name = hashlib.sha1('%s:%s' % (kind, os.path.abspath(file_path)))
+    return os.path.join(cache_dir, '%s.pkl' % name.hexdigest())
+
+def _file_key(file_path):
+    """
+    Path, size, mtime and content hash of a source file.
+    """
+    stat = os.stat(file_path)
+    with open(file_path, 'rb') as fh:
+        content_hash = hashlib.sha1(fh.read()).hexdigest()
+    return (os.path.abspath(file_path), stat.st_size, stat.st_mtime,
+            content_hash)
+
+def restore(obj, file_path, cache):
+    """
+    Restore the attributes listed in obj._CACHED_ATTRS from the cache entry
+    of file_path. Returns False, leaving obj untouched, if caching is off or
+    the entry is missing, stale or unreadable; bad entries are removed.
+    """
+    if not cache:
+        return False
+    entry = _entry_path(_cache_dir(cache), obj.__class__.__name__, file_path)
+    if not os.path.exists(entry):
+        return False
+
+    try:
+        with open(entry, 'rb') as fh:
+            snapshot = pickle.load(fh)
+        valid = snapshot['version'] == CACHE_VERSION and \
+                snapshot['pandas'] == pd.__version__ and \
+                snapshot['key'] == _file_key(file_path)
+    except Exception:
+        valid = False
+
+    if not valid:
+        try:
+            os.remove(entry)
+        except OSError:
+            pass
+        return False
+
+    for attr in obj._CACHED_ATTRS:
+        setattr(obj, attr, snapshot['state'][attr])
+    os.utime(entry, None) # Mark as recently used for eviction
+    return True
+
+def save(obj, file_path, cache, max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Store the attributes listed in obj._CACHED_ATTRS as the cache entry of
+    file_path, then evict the least recently used entries until the cache
+    directory holds no more than max_bytes.
+    """
+    if not cache:
+        return
+    cache_dir = _cache_dir(cache)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    snapshot = {'version': CACHE_VERSION,
+                'pandas': pd.__version__,
+                'key': _file_key(file_path),
+                'state': dict((attr, getattr(obj, attr))
+                              for attr in obj._CACHED_ATTRS)}
+
+    # Write to a temporary file first so that readers never see a partial
+    # entry.
+    entry = _entry_path(cache_dir, obj.__class__.__name__, file_path)
+    fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as fh:
+        pickle.dump(snapshot, fh, pickle.HIGHEST_PROTOCOL)
+    os.rename(temp_path, entry)
+
+    evict(cache_dir, max_bytes)
+
+def evict(cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Remove the least recently used entries in cache_dir until their total
+    size is at most max_bytes.
+    """
+    entries = [(os.path.getmtime(e), os.path.getsize(e), e)
+               for e in glob(os.path.join(cache_dir, '*.pkl'))]
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(entry)
+        except OSError:
+            pass
+        total -= size
+
+def clear(cache=True):
+    """
+    Remove every entry from the cache.
+    """
+    evict(_cache_dir(cache), 0)
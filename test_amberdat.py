@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+'''
+@author: Dazhi Tan
+@created: October 18th, 2026
+'''
+import os, sys, tempfile, unittest
+from StringIO import StringIO
+from amberdat import AmberDat
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+class CloneTypeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stdout, sys.stdout = sys.stdout, StringIO()
+        fd, self.out_path = tempfile.mkstemp(suffix='.dat')
+        os.close(fd)
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        os.remove(self.out_path)
+
+    def test_cloned_torsions_are_contiguous(self):
+        dat = AmberDat(os.path.join(HERE, 'stx-amber-proteins.dat'))
+        nproper = len(dat.proper_df)
+        dat.cloneType('CT', 'ZT')
+        dat.printDat(self.out_path)
+        proper_df = AmberDat(self.out_path).proper_df[nproper:]
+        self.assertTrue(len(proper_df) > 0)
+
+        # Every cloned torsion is one run of rows, in which all rows but the
+        # last have a negative periodicity.
+        keys = ['-'.join(t) for t in 
+                proper_df[['type1', 'type2', 'type3', 'type4']].values]
+        runs = []
+        for n, key in enumerate(keys):
+            if n == 0 or key != keys[n - 1]:
+                runs.append((key, []))
+            runs[-1][1].append(proper_df['periodicity'].values[n])
+        run_keys = [key for key, _ in runs]
+        self.assertEqual(len(run_keys), len(set(run_keys)))
+        for key, periodicity in runs:
+            self.assertTrue(all(p < 0 for p in periodicity[:-1]), key)
+            self.assertTrue(periodicity[-1] > 0, key)
+
+class BulkTermTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stdout, sys.stdout = sys.stdout, StringIO()
+        self.dat = AmberDat(os.path.join(HERE, 'stx-amber-proteins.dat'))
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+
+    def _rows(self, table, atomtype):
+        df = getattr(self.dat, '%s_df' % table)
+        return df[df['type'] == atomtype]
+
+    def test_add_masses_with_and_without_pol(self):
+        skipped = self.dat.addMasses([('ZZ', 1.0, 0.5), ('ZY', 2.0)])
+        self.assertEqual(len(skipped), 0)
+        self.assertEqual(list(self._rows('mass', 'ZZ')[['mass', 'pol']]
+                              .values[0]), [1.0, 0.5])
+        self.assertEqual(list(self._rows('mass', 'ZY')[['mass', 'pol']]
+                              .values[0]), [2.0, 0.0])
+        self.dat.addMasses([('ZX', 3.0)])
+        self.assertEqual(list(self._rows('mass', 'ZX')[['mass', 'pol']]
+                              .values[0]), [3.0, 0.0])
+
+    def test_bulk_setters_match_single_setters(self):
+        # A type with two rows: setVdw sets both, setMass neither, and the
+        # bulk versions do the same.
+        for table, row in [('vdw', ['ZZ', 1.0, 0.1]), 
+                           ('mass', ['ZZ', 1.0, 0.0])]:
+            df = getattr(self.dat, '%s_df' % table)
+            for n in range(2):
+                df.loc[len(df)] = row + [''] * (len(df.columns) - len(row))
+
+        skipped = self.dat.setVdws([('ZZ', 2.0, 0.2)])
+        self.assertEqual(len(skipped), 0)
+        self.assertEqual(self._rows('vdw', 'ZZ')[['half_rmin', 'epsilon']]
+                         .values.tolist(), [[2.0, 0.2]] * 2)
+        self.dat.setVdw('ZZ', 3.0, 0.3)
+        self.assertEqual(self._rows('vdw', 'ZZ')[['half_rmin', 'epsilon']]
+                         .values.tolist(), [[3.0, 0.3]] * 2)
+
+        skipped = self.dat.setMasses([('ZZ', 2.0)])
+        self.assertEqual(len(skipped), 1)
+        self.dat.setMass('ZZ', 3.0)
+        self.assertEqual(list(self._rows('mass', 'ZZ')['mass']), [1.0, 1.0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+'''
+@author: Dazhi Tan
+@created: October 18th, 2026
+'''
+import os, sys, tempfile, unittest
+from StringIO import StringIO
+from amberlib import AmberLib
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LIB_FILES = ['allamino_stxamber.lib', 'allamino_stxamber_new.lib', 'test.lib']
+
+class ChargeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stdout, sys.stdout = sys.stdout, StringIO()
+        fd, self.out_path = tempfile.mkstemp(suffix='.lib')
+        os.close(fd)
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        os.remove(self.out_path)
+
+    def test_summary_sees_charge_edits(self):
+        # Files written by printLib name the charge column 'dbl chg '.
+        for lib_file in LIB_FILES:
+            lib = AmberLib(os.path.join(HERE, lib_file))
+            before = lib.chargeSummary().loc['ALA', 'charge']
+            old_charge = lib.data['ALA']['atoms'].iloc[0, -1]
+            lib.setAtomCharge('ALA', 'N', old_charge - 0.3)
+            lib.applyAtomAssignments([('GLY', 'N', 'N', -0.4)])
+
+            self.assertEqual(len(lib.data['ALA']['atoms'].columns), 8)
+            summary = lib.chargeSummary()
+            self.assertAlmostEqual(summary.loc['ALA', 'charge'], before - 0.3)
+            self.assertAlmostEqual(summary.loc['ALA', 'charge'], 
+                                   lib.calcNetCharge('ALA'))
+            self.assertAlmostEqual(summary.loc['GLY', 'charge'], 
+                                   lib.calcNetCharge('GLY'))
+
+    def test_neutralize_round_trip(self):
+        for lib_file in LIB_FILES:
+            lib = AmberLib(os.path.join(HERE, lib_file))
+            lib.setAtomCharge('ALA', 'CA', 0.1)
+            self.assertTrue(lib.chargeSummary().loc['ALA', 'flagged'])
+            summary = lib.neutralizeCharges(atoms={'ALA': ['CA', 'CB']})
+            self.assertFalse(summary['flagged'].any())
+
+            lib.printLib(self.out_path)
+            summary = AmberLib(self.out_path).chargeSummary(tolerance=1e-5)
+            self.assertFalse(summary['flagged'].any(), lib_file)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+'''
+@author: Dazhi Tan
+@created: October 18th, 2026
+'''
+import os, unittest
+from desmondff import DesmondFF, TermTable
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+VIPARR_DIR = os.path.join(HERE, 'stx_amber_protein_viparr')
+
+class TermTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.plain = DesmondFF(VIPARR_DIR)
+        self.compact = DesmondFF(VIPARR_DIR, compact=True)
+
+    def test_same_terms_as_json(self):
+        for name in ['mass', 'vdw1', 'stretch_harm', 'angle_harm', 
+                     'dihedral_trig', 'improper_trig']:
+            self.assertTrue(isinstance(self.compact[name], TermTable))
+            self.assertEqual(self.compact.toJSON(name), self.plain[name])
+
+    def test_indexing_and_slicing(self):
+        for name in ['mass', 'stretch_harm']:
+            plain, compact = self.plain[name], self.compact[name]
+            self.assertEqual(compact[0], plain[0])
+            self.assertEqual(compact[-1], plain[-1])
+            for s in [slice(None, 2), slice(3, None, 7), slice(-5, -1), 
+                      slice(None, None, -1), slice(10, 2)]:
+                self.assertEqual(compact[s], plain[s])
+
+class LookupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.plain = DesmondFF(VIPARR_DIR)
+        self.compact = DesmondFF(VIPARR_DIR, compact=True)
+
+    def test_multi_term_torsion(self):
+        # ND-CS-C-ND has two dihedral_trig components, rows 437 and 438, 
+        # and falls back to *-C-CS-*, row 105, with other end types.
+        for ff in [self.plain, self.compact]:
+            table = ff['dihedral_trig']
+            torsion = [table[437], table[438]]
+            self.assertEqual(ff.lookup('dihedral_trig', 'ND CS C ND'), 
+                             torsion)
+            self.assertEqual(ff.lookup('dihedral_trig', ['ND', 'C', 'CS', 
+                                                         'ND']), torsion)
+            self.assertEqual(ff.lookup('dihedral_trig', 'CT CS C N'), 
+                             [table[105]])
+            self.assertEqual(ff.lookup('dihedral_trig', 'ZZ ZZ ZZ ZZ'), [])
+
+            rows, offsets = ff.lookupMany('dihedral_trig', 
+                [('ND', 'CS', 'C', 'ND'), ('ZZ', 'ZZ', 'ZZ', 'ZZ'), 
+                 ('CT', 'CS', 'C', 'N'), ('ND', 'C', 'CS', 'ND')])
+            self.assertEqual(list(offsets), [0, 2, 2, 3, 5])
+            self.assertEqual(list(rows), [437, 438, 105, 437, 438])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+'''
+@author: Dazhi Tan
+@created: October 18th, 2026
+'''
+import os, sys, gzip, bz2, shutil, tempfile, unittest
+from glob import glob
+from StringIO import StringIO
+import fileio
+from amberdat import AmberDat
+from amberlib import AmberLib
+from desmondff import DesmondFF
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DAT_FILES = sorted(glob(os.path.join(HERE, '*.dat')))
+LIB_FILES = sorted(glob(os.path.join(HERE, '*.lib')))
+VIPARR_DIRS = sorted(d for d in glob(os.path.join(HERE, '*viparr')) + 
+                     glob(os.path.join(HERE, 'viparr_dirs', '*'))
+                     if os.path.isdir(d))
+COMPRESSORS = {'gz': gzip.GzipFile, 'bz2': bz2.BZ2File}
+
+def _compress(src_path, dst_path, kind):
+    with open(src_path, 'rb') as fh:
+        content = fh.read()
+    out_fh = COMPRESSORS[kind](dst_path, 'wb')
+    out_fh.write(content)
+    out_fh.close()
+
+class RoundTripTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stdout, sys.stdout = sys.stdout, StringIO()
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        shutil.rmtree(self.temp_dir)
+
+    def _checkRoundTrip(self, file_path, load, print_method):
+        name = os.path.basename(file_path)
+        plain_out = os.path.join(self.temp_dir, 'plain_' + name)
+        getattr(load(file_path), print_method)(plain_out)
+        with open(plain_out) as fh:
+            expected = fh.read()
+
+        for kind in COMPRESSORS:
+            compressed = os.path.join(self.temp_dir, '%s.%s' % (name, kind))
+            _compress(file_path, compressed, kind)
+            self.assertEqual(fileio.compression(compressed), kind)
+
+            out = os.path.join(self.temp_dir, 'out_%s.%s' % (name, kind))
+            getattr(load(compressed), print_method)(out)
+            self.assertEqual(fileio.compression(out), kind)
+            self.assertEqual(fileio.read(out), expected, 
+                             '%s with %s' % (name, kind))
+
+    def test_dat_files(self):
+        for dat_file in DAT_FILES:
+            self._checkRoundTrip(dat_file, AmberDat, 'printDat')
+
+    def test_lib_files(self):
+        for lib_file in LIB_FILES:
+            self._checkRoundTrip(lib_file, AmberLib, 'printLib')
+
+    def test_viparr_dirs(self):
+        for viparr_dir in VIPARR_DIRS:
+            expected = dict(DesmondFF(viparr_dir).iteritems())
+            for kind in COMPRESSORS:
+                compressed_dir = os.path.join(self.temp_dir, '%s_%s' % 
+                                              (os.path.basename(viparr_dir),
+                                               kind))
+                os.mkdir(compressed_dir)
+                for file_path in glob(os.path.join(viparr_dir, '*')):
+                    _compress(file_path, os.path.join(compressed_dir, 
+                        '%s.%s' % (os.path.basename(file_path), kind)), kind)
+                self.assertEqual(dict(DesmondFF(compressed_dir).iteritems()),
+                                 expected, '%s with %s' % (viparr_dir, kind))
+                try:
+                    from helper import load_viparr_dir
+                except ImportError:
+                    continue # helper needs lxml
+                self.assertEqual(load_viparr_dir(compressed_dir), 
+                                 load_viparr_dir(viparr_dir))
+
+if __name__ == '__main__':
+    unittest.main()
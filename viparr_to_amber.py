@@ -4,6 +4,8 @@
 @created: July 14th, 2017
 '''
 import os, re, json, argparse
+import numpy as np
+import pandas as pd
 import amberlib
 import amberdat
 import desmondff
@@ -23,6 +25,7 @@ def desmond_template_to_amberlib(viparr_dir, in_amberlib, out_amberlib):
     for key, json in desmond_ff.iteritems():
         if 'template' in key:
             template_jsons.append(json)
+    assignments = []
     for tj in template_jsons:
         for resiname, resiparam in tj.iteritems():
             for atomparam in resiparam['atoms']:
@@ -41,125 +44,101 @@ def desmond_template_to_amberlib(viparr_dir, in_amberlib, out_amberlib):
                 #nonbonded_type = '"%s"' % nonbonded_type
                 #charge = '%.6f' % charge
 
-                # Set properties
-                template_amberlib.setAtomType(resiname, atom_name, bonded_type) 
-                template_amberlib.setAtomCharge(resiname, atom_name, charge) 
+                assignments.append((resiname, atom_name, bonded_type, charge))
+
+    # Set properties
+    unmatched = template_amberlib.applyAtomAssignments(assignments)
+    if len(unmatched) > 0:
+        print 'Atoms not found in %s:' % template_amberlib
+        print unmatched
 
     template_amberlib.printLib(out_amberlib)
 
 
+def _term_columns(desmond_ff, filename, wildcard='X'):
+    """
+    The types of a viparr term table as an (n, ntypes) object array, with 
+    the amber spelling of the types, '*' wildcards as wildcard and '&' as 
+    '*', and its params as a dict of float arrays.
+    """
+    table = desmond_ff[filename]
+    if not isinstance(table, desmondff.TermTable):
+        table = desmondff.TermTable.fromJSON(filename, table)
+        assert table is not None, \
+            "%s in %s does not fit its term schema." % (filename, desmond_ff)
+    types = np.array(table.types, dtype=object).reshape(len(table), 
+                                                        table.ntypes)
+    amber_types = dict((t, wildcard if t == '*' else t.replace('&', '*'))
+                       for t in set(types.ravel()))
+    types = np.vectorize(amber_types.get, otypes=[object])(types) \
+            if len(table) else types
+    params = dict((p, table.column(p)) for p in table.param_names)
+    return types, params
+
+def _melt_torsions(types, params):
+    """
+    Melt the fc1..fc6 Fourier components of a viparr torsion table into one
+    row per component, in component order within each torsion, with columns
+    type1..type4, fc, theta0 and periodicity. fc0 is ignored.
+    """
+    nterms = len(types)
+    frame = pd.DataFrame(np.repeat(types, 6, axis=0), 
+                         columns=['type1', 'type2', 'type3', 'type4'])
+    frame['fc'] = np.column_stack([params['fc%d' % n] 
+                                   for n in range(1, 7)]).ravel()
+    frame['theta0'] = np.repeat(params['phi0'], 6)
+    frame['periodicity'] = np.tile(np.arange(1, 7), nterms)
+    return frame
+
 def desmond_params_to_amberdat(viparr_dir, out_amberdat):
 
-    desmond_ff = DesmondFF(viparr_dir)
-    amber_dat = AmberDat()
+    desmond_ff = DesmondFF(viparr_dir, compact=True)
+    amber_dat = AmberDat(defer_torsions=True)
 
     amber_dat.setTitle('STX-AMBER')
 
     # Process mass
-    for massparam in desmond_ff['mass']:
-        # Clean up
-        for n, t in enumerate(massparam['type']):
-            if t == '*':
-                massparam['type'][n] = 'X'
-            else:
-                t = t.replace('&', '*')
-                massparam['type'][n] = t
-        atomtype = massparam['type'][0]
-        mass = float(massparam['params']['amu'])
-        amber_dat.addMass(atomtype, mass)
-
-    #Process stretch
-    for stretchparam in desmond_ff['stretch_harm']:
-        # Clean up
-        for n, t in enumerate(stretchparam['type']):
-            if t == '*':
-                stretchparam['type'][n] = 'X'
-            else:
-                t = t.replace('&', '*')
-                stretchparam['type'][n] = t
-        atomtype1, atomtype2 = stretchparam['type']
-        fc = stretchparam['params']['fc']
-        r0 = stretchparam['params']['r0']
-        amber_dat.addStretch(atomtype1, atomtype2, fc, r0)
-
-    #Process angle
-    for angleparam in desmond_ff['angle_harm']:
-        # Clean up
-        for n, t in enumerate(angleparam['type']):
-            if t == '*':
-                angleparam['type'][n] = 'X'
-            else:
-                t = t.replace('&', '*')
-                angleparam['type'][n] = t
-        atomtype1, atomtype2, atomtype3, = angleparam['type']
-        fc = angleparam['params']['fc']
-        theta0 = angleparam['params']['theta0']
-        amber_dat.addAngle(atomtype1, atomtype2, atomtype3, fc, theta0)
-
-    #Process proper torsion
-
-    amber_torsion_list = []
-    for properparam in desmond_ff['dihedral_trig']:
-        # Clean up
-        for n, t in enumerate(properparam['type']):
-            if t == '*':
-                properparam['type'][n] = 'X'
-            else:
-                t = t.replace('&', '*')
-                properparam['type'][n] = t
-
-        atomtype1, atomtype2, atomtype3, atomtype4, = properparam['type']
-        phase_angle = properparam['params']['phi0']
-
-        #-----------------------------------------------#
-        # keys are phi0, fc0, fc1, ... fc6. Ignore fc0. #
-        #-----------------------------------------------#
-        for key, value in properparam['params'].iteritems():
-            if '0' in key : 
-                continue  
-            else:
-                periodicity = int(key[-1])
-                fc = value
-                amber_torsion_list.append(
-                    [atomtype1, atomtype2, atomtype3, atomtype4, 1, fc, phase_angle, periodicity])
-    for torsion_term in amber_torsion_list:
-        amber_dat.addProper(*torsion_term)
-
-    #Process improper torsion
-    for improperparam in desmond_ff['improper_trig']:
-        # Clean up
-        for n, t in enumerate(improperparam['type']):
-            if t == '*':
-                improperparam['type'][n] = 'X'
-            else:
-                t = t.replace('&', '*')
-                improperparam['type'][n] = t
-
-        atomtype1, atomtype2, atomtype3, atomtype4 = improperparam['type']
-        phase_angle = improperparam['params']['phi0']
-
-        #-----------------------------------------------#
-        # keys are phi0, fc0, fc1, ... fc6. Ignore fc0. #
-        #-----------------------------------------------#
-        for key, value in improperparam['params'].iteritems():
-            if '0' in key : 
-                continue  
-            elif value == 0:
-                continue
-            elif value < 0:
-                periodicity = int(key[-1])
-                fc = value
-                amber_dat.addImproper(atomtype1, atomtype2, atomtype3, atomtype4, -fc, phase_angle+180, periodicity)
-            else:
-                periodicity = int(key[-1])
-                fc = value
-                amber_dat.addImproper(atomtype1, atomtype2, atomtype3, atomtype4, fc, phase_angle, periodicity)
-    # Process vdw
-    for vdwparam in desmond_ff['vdw1']:
-        atomtype = vdwparam['type'][0].replace('&', '*')
-        sigma, epsilon = vdwparam['params']['sigma'], vdwparam['params']['epsilon']
-        Rmin_2 = sigma * 2**(1./6) / 2.
-        amber_dat.addVdw(atomtype, Rmin_2, epsilon)
+    types, params = _term_columns(desmond_ff, 'mass')
+    amber_dat.addMasses(pd.DataFrame({'type': types[:, 0], 
+                                      'mass': params['amu']}))
+
+    # Process stretch
+    types, params = _term_columns(desmond_ff, 'stretch_harm')
+    amber_dat.addStretches(pd.DataFrame({'type1': types[:, 0], 
+                                         'type2': types[:, 1],
+                                         'fc': params['fc'], 
+                                         'r0': params['r0']}))
+
+    # Process angle
+    types, params = _term_columns(desmond_ff, 'angle_harm')
+    amber_dat.addAngles(pd.DataFrame({'type1': types[:, 0], 
+                                      'type2': types[:, 1],
+                                      'type3': types[:, 2],
+                                      'fc': params['fc'], 
+                                      'theta0': params['theta0']}))
+
+    # Process proper torsion, one term per Fourier component, zeros included
+    types, params = _term_columns(desmond_ff, 'dihedral_trig')
+    propers = _melt_torsions(types, params)
+    propers['divider'] = 1
+    amber_dat.addPropers(propers)
+
+    # Process improper torsion. Zero components are dropped, and a negative
+    # fc is flipped to positive with the phase shifted by 180 degrees.
+    types, params = _term_columns(desmond_ff, 'improper_trig')
+    impropers = _melt_torsions(types, params)
+    impropers = impropers[impropers['fc'] != 0].copy()
+    negative = impropers['fc'] < 0
+    impropers['fc'] = impropers['fc'].abs()
+    impropers['theta0'] += np.where(negative, 180, 0)
+    amber_dat.addImpropers(impropers)
+
+    # Process vdw, whose wildcards are kept
+    types, params = _term_columns(desmond_ff, 'vdw1', wildcard='*')
+    amber_dat.addVdws(pd.DataFrame({'type': types[:, 0],
+                                    'half_rmin': params['sigma'] * 
+                                                 2**(1./6) / 2.,
+                                    'epsilon': params['epsilon']}))
 
     amber_dat.printDat(out_amberdat)
 
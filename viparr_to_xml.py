@@ -10,7 +10,7 @@ from lxml.etree import XPath
 from glob import glob
 from math import radians, pi
 from forcefieldxml import ForceField
-from helper import load_viparr_dir
+from desmondff import DesmondFF
 
 def lookup_lj_param(nonbonded_type, vdw_json):
     for item in vdw_json:
@@ -35,17 +35,33 @@ def lookup_element(atomic_number):
                     35:'Br', 37:'Rb', 47:'Ag', 53:'I', 55:'Cs', 79:'Au', 80:'Hg'} 
     return element_dict[atomic_number]
 
+class _XmlTypes(dict):
+    """
+    Viparr types cleaned up for the xml file, '&' spelled out and wildcards
+    dropped, computed once per type.
+    """
+    def __missing__(self, viparr_type):
+        xml_type = viparr_type.replace("&", "amp").replace("*", "")
+        self[viparr_type] = xml_type
+        return xml_type
+
 def viparr_to_xml(viparr_dir, xml_file_name):
 
-    viparr_json_dict = load_viparr_dir(viparr_dir)
+    viparr_ff = DesmondFF(viparr_dir)
     ff = ForceField()
+    xml_types = _XmlTypes()
+
     #-------------------------#
     # Process templates files #
     #-------------------------#
     template_jsons = []
-    for key, json in viparr_json_dict.iteritems():
+    for key in viparr_ff.keys():
         if 'template' in key:
-            template_jsons.append(json)
+            template_jsons.append(viparr_ff[key])
+    # vdw and mass params are looked up once per type, through the type
+    # index of viparr_ff.
+    lj_params = dict()
+    masses = dict()
     for tj in template_jsons:
         for resiname, resiparam in tj.iteritems():
             ff.addResidue(resiname)
@@ -53,11 +69,21 @@ def viparr_to_xml(viparr_dir, xml_file_name):
                 (atom_name, atomic_number, charge, 
                  [bonded_type, nonbonded_type]) = atomparam
 
-                sigma, epsilon = \
-                lookup_lj_param(nonbonded_type, viparr_json_dict['vdw1'])
-
-                mass = \
-                lookup_mass(bonded_type, viparr_json_dict['mass'])
+                if nonbonded_type not in lj_params:
+                    vdw_terms = viparr_ff.lookup('vdw1', [nonbonded_type])
+                    assert vdw_terms, \
+                        "No vdw1 params for type %s of atom %s in %s." \
+                        % (nonbonded_type, atom_name, resiname)
+                    vdw_params = vdw_terms[0]['params']
+                    lj_params[nonbonded_type] = \
+                        (vdw_params['sigma']*0.1, vdw_params['epsilon']*4.184)
+                sigma, epsilon = lj_params[nonbonded_type]
+
+                if bonded_type not in masses:
+                    mass_terms = viparr_ff.lookup('mass', [bonded_type])
+                    masses[bonded_type] = mass_terms[0]['params']['amu'] \
+                                          if mass_terms else None
+                mass = masses[bonded_type]
 
                 element = lookup_element(atomic_number)
 
@@ -68,9 +94,7 @@ def viparr_to_xml(viparr_dir, xml_file_name):
                 add_atom = ff.addAtom(resiname, atom_name)
                 atom_type = add_atom.attrib['type']
 
-                bonded_type = bonded_type.replace("&", "amp")
-                bonded_type = bonded_type.replace("*", "")
-                nonbonded_type = nonbonded_type.replace("&", "amp")
+                bonded_type = xml_types[bonded_type]
 
                 ff.addAtom(resiname, atom_name)
                 ff.addType(atom_type, bonded_type, element, mass) 
@@ -90,41 +114,29 @@ def viparr_to_xml(viparr_dir, xml_file_name):
     #---------------#
     # Process rules #
     #---------------#
-    es_scale, lj_scale = viparr_json_dict['rules']['es_scale'][-1], \
-                         viparr_json_dict['rules']['lj_scale'][-1]
+    es_scale, lj_scale = viparr_ff['rules']['es_scale'][-1], \
+                         viparr_ff['rules']['lj_scale'][-1]
     ff.setNonbondedRules(es_scale, lj_scale)
 
     #----------------------#
     # Process stretch_harm #
     #----------------------#
-    for stretch_term in viparr_json_dict['stretch_harm']:
+    for stretch_term in viparr_ff['stretch_harm']:
         k, length = stretch_term['params']['fc']*4.184*10**2*2, \
                     stretch_term['params']['r0']*0.1
-	if not isinstance(stretch_term['type'], list):
-		stretch_term['type'] = stretch_term['type'].split(' ')
-        bonded_type1, bonded_type2 = stretch_term['type']
-        bonded_type1 = bonded_type1.replace("&", "amp")
-        bonded_type1 = bonded_type1.replace("*", "")
-        bonded_type2 = bonded_type2.replace("&", "amp")
-        bonded_type2 = bonded_type2.replace("*", "")
+        bonded_type1, bonded_type2 = [xml_types[t] 
+                                      for t in stretch_term['type']]
         
         ff.addHarmonicBondForce(bonded_type1, bonded_type2, length, k) 
 
     #--------------------#
     # Process angle_harm # 
     #--------------------#
-    for angle_term in viparr_json_dict['angle_harm']:
+    for angle_term in viparr_ff['angle_harm']:
         k, theta = angle_term['params']['fc']*4.184*2, \
                    radians(angle_term['params']['theta0'])
-	if not isinstance(angle_term['type'], list):
-		angle_term['type'] = angle_term['type'].split(' ')
-        bonded_type1, bonded_type2, bonded_type3 = angle_term['type']
-        bonded_type1 = bonded_type1.replace("&", "amp")
-        bonded_type1 = bonded_type1.replace("*", "")
-        bonded_type2 = bonded_type2.replace("&", "amp")
-        bonded_type2 = bonded_type2.replace("*", "")
-        bonded_type3 = bonded_type3.replace("&", "amp")
-        bonded_type3 = bonded_type3.replace("*", "")
+        bonded_type1, bonded_type2, bonded_type3 = [xml_types[t] 
+                                                    for t in angle_term['type']]
         
         ff.addHarmonicAngleForce(bonded_type1, bonded_type2, bonded_type3, 
                                  theta, k) 
@@ -134,20 +146,10 @@ def viparr_to_xml(viparr_dir, xml_file_name):
     #-----------------------#
     existing_atom_list = []
     initializer = 1
-    for proper_term in viparr_json_dict['dihedral_trig']:
-	if not isinstance(proper_term['type'], list):
-		proper_term['type'] = proper_term['type'].split(' ')
-        bonded_type1, bonded_type2, bonded_type3, bonded_type4 = proper_term['type']
-        bonded_type1 = bonded_type1.replace("&", "amp")
-        bonded_type1 = bonded_type1.replace("*", "")
-        bonded_type2 = bonded_type2.replace("&", "amp")
-        bonded_type2 = bonded_type2.replace("*", "")
-        bonded_type3 = bonded_type3.replace("&", "amp")
-        bonded_type3 = bonded_type3.replace("*", "")
-        bonded_type4 = bonded_type4.replace("&", "amp")
-        bonded_type4 = bonded_type4.replace("*", "")
-
-        current_atom_list = [bonded_type1, bonded_type2, bonded_type3, bonded_type4]
+    for proper_term in viparr_ff['dihedral_trig']:
+        current_atom_list = [xml_types[t] for t in proper_term['type']]
+        bonded_type1, bonded_type2, bonded_type3, bonded_type4 = \
+            current_atom_list
         
         if current_atom_list != existing_atom_list:
             existing_atom_list = current_atom_list
@@ -198,18 +200,9 @@ def viparr_to_xml(viparr_dir, xml_file_name):
     #------------------------#
     # Process improper_trig  # 
     #------------------------#
-    for improper_term in viparr_json_dict['improper_trig']:
-	if not isinstance(improper_term['type'], list):
-		improper_term['type'] = improper_term['type'].split(' ')
-        bonded_type1, bonded_type2, bonded_type3, bonded_type4 = improper_term['type']
-        bonded_type1 = bonded_type1.replace("&", "amp")
-        bonded_type1 = bonded_type1.replace("*", "")
-        bonded_type2 = bonded_type2.replace("&", "amp")
-        bonded_type2 = bonded_type2.replace("*", "")
-        bonded_type3 = bonded_type3.replace("&", "amp")
-        bonded_type3 = bonded_type3.replace("*", "")
-        bonded_type4 = bonded_type4.replace("&", "amp")
-        bonded_type4 = bonded_type4.replace("*", "")
+    for improper_term in viparr_ff['improper_trig']:
+        bonded_type1, bonded_type2, bonded_type3, bonded_type4 = \
+            [xml_types[t] for t in improper_term['type']]
 
         kwargs = dict()
         phase_angle = radians(improper_term['params']['phi0'])